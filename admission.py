@@ -0,0 +1,222 @@
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+from video_decode import probe_video
+
+# Admission control for video analysis. Every upload goes through
+# AdmissionController.admit() before its body is read:
+#
+#   with admission.admit(user_id, request.content_length) as ticket:
+#       video_path = save_upload(...)
+#       ticket.start_analysis(video_path)   # duration check, then waits for a slot
+#       ... run the analysis ...
+#
+# Rejections raise AdmissionRejected, which app.py turns into a 413/429/503
+# response with a Retry-After header. Limits are per process.
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = {
+    'max_concurrent': 2,        # Analyses running at once
+    'max_queue': 4,             # Uploads allowed to wait for a slot
+    'queue_timeout': 30,        # Seconds an upload may wait for a slot
+    'user_rate': 6,             # Uploads per minute per user
+    'user_burst': 3,
+    'global_rate': 60,          # Uploads per minute for the whole server
+    'global_burst': 10,
+    'max_upload_mb': 100,
+    'max_duration': 600,        # Seconds of video
+    'latency_budget': 60,       # Seconds an analysis should take, see pose_engine.py
+}
+
+RELOAD_INTERVAL = 1.0  # Seconds between config file checks
+CANCEL_POLL_INTERVAL = 0.5  # Seconds between cancellation checks while queued
+
+# Starting estimates until real analyses have been measured
+INITIAL_SECONDS_PER_FRAME = 0.03
+INITIAL_FRAMES_PER_JOB = 300
+SMOOTHING = 0.2
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status, message, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute, burst):
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.configure(rate_per_minute, burst)
+
+    def configure(self, rate_per_minute, burst):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+
+    def take(self):
+        # Returns 0 if a token was taken, otherwise the seconds until one is available
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        if self.rate <= 0:
+            return 60
+        return (1 - self.tokens) / self.rate
+
+
+class Ticket:
+    def __init__(self, controller, queued):
+        self.controller = controller
+        self.queued = queued
+        self.waiting = queued
+        self.running = False
+        self.frames = None
+        self.started = None
+
+    def start_analysis(self, video_path, cancelled=None):
+        # Check the decoded length before spending any inference on it, then
+        # wait for an analysis slot (or until the `cancelled` event is set)
+        config = self.controller.config()
+        info = probe_video(video_path)
+        if info.duration and info.duration > config['max_duration']:
+            raise AdmissionRejected(413, f"Video is longer than {config['max_duration']} seconds")
+        self.frames = info.frame_count
+        if self.queued:
+            self.controller.acquire(self, cancelled)
+        self.started = time.monotonic()
+        return info
+
+    def release(self):
+        # Give the queue place or slot back before the request is done, e.g.
+        # while it only waits on another request's analysis
+        self.controller.release(self, False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.controller.release(self, exc_type is None)
+        return False
+
+
+class AdmissionController:
+    def __init__(self, config_path):
+        self.config_path = config_path
+        self.cond = threading.Condition()
+        self._config = dict(DEFAULT_CONFIG)
+        self._config_mtime = None
+        self._config_checked = 0.0
+        self.active = 0
+        self.waiting = 0
+        self.seconds_per_frame = INITIAL_SECONDS_PER_FRAME
+        self.frames_per_job = INITIAL_FRAMES_PER_JOB
+        self.global_bucket = TokenBucket(self._config['global_rate'], self._config['global_burst'])
+        self.user_buckets = {}
+
+    def config(self):
+        # Reload the config file when it changes, so limits can be tuned
+        # without restarting the server
+        now = time.monotonic()
+        if now - self._config_checked < RELOAD_INTERVAL:
+            return self._config
+        with self.cond:
+            self._config_checked = now
+            try:
+                mtime = os.path.getmtime(self.config_path)
+            except OSError:
+                mtime = None
+            if mtime != self._config_mtime:
+                self._config_mtime = mtime
+                config = dict(DEFAULT_CONFIG)
+                if mtime is not None:
+                    try:
+                        with open(self.config_path) as f:
+                            config.update(json.load(f))
+                    except (OSError, ValueError) as e:
+                        logger.warning("Keeping previous admission config, %s is invalid: %s", self.config_path, e)
+                        return self._config
+                self._config = config
+                self.global_bucket.configure(config['global_rate'], config['global_burst'])
+                for bucket in self.user_buckets.values():
+                    bucket.configure(config['user_rate'], config['user_burst'])
+                # More slots may have opened up
+                self.cond.notify_all()
+        return self._config
+
+    def admit(self, user_id, content_length, queued=True):
+        config = self.config()
+        if content_length is None:
+            raise AdmissionRejected(411, "Content-Length is required")
+        if content_length > config['max_upload_mb'] * 1024 * 1024:
+            raise AdmissionRejected(413, f"Upload is larger than {config['max_upload_mb']} MB")
+
+        with self.cond:
+            if queued and self.active + self.waiting >= config['max_concurrent'] + config['max_queue']:
+                raise AdmissionRejected(503, "Server is busy, try again later", self._retry_after(config))
+
+            bucket = self.user_buckets.get(user_id)
+            if bucket is None:
+                bucket = self.user_buckets[user_id] = TokenBucket(config['user_rate'], config['user_burst'])
+            wait = bucket.take()
+            if wait:
+                raise AdmissionRejected(429, "Too many uploads, slow down", math.ceil(wait))
+            wait = self.global_bucket.take()
+            if wait:
+                bucket.tokens += 1  # Not the user's fault, give their token back
+                raise AdmissionRejected(429, "Too many uploads, slow down", math.ceil(wait))
+
+            if queued:
+                self.waiting += 1
+            return Ticket(self, queued)
+
+    def acquire(self, ticket, cancelled=None):
+        config = self.config()
+        deadline = time.monotonic() + config['queue_timeout']
+        with self.cond:
+            while self.active >= self._config['max_concurrent']:
+                if cancelled is not None and cancelled.is_set():
+                    return
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise AdmissionRejected(503, "Server is busy, try again later", self._retry_after(self._config))
+                self.cond.wait(min(remaining, CANCEL_POLL_INTERVAL))
+            self.waiting -= 1
+            ticket.waiting = False
+            self.active += 1
+            ticket.running = True
+
+    def release(self, ticket, succeeded):
+        with self.cond:
+            if ticket.waiting:
+                self.waiting -= 1
+                ticket.waiting = False
+            if ticket.running:
+                self.active -= 1
+                ticket.running = False
+                self.cond.notify()
+            if succeeded and ticket.frames and ticket.started is not None:
+                elapsed = time.monotonic() - ticket.started
+                self.seconds_per_frame += SMOOTHING * (elapsed / ticket.frames - self.seconds_per_frame)
+                self.frames_per_job += SMOOTHING * (ticket.frames - self.frames_per_job)
+
+    def load(self):
+        # Fraction of analysis capacity in use, above 1 when uploads are queued
+        with self.cond:
+            return (self.active + self.waiting) / max(self._config['max_concurrent'], 1)
+
+    def _retry_after(self, config):
+        # Time until the work ahead of a new upload has drained, from the
+        # measured per-frame throughput
+        slots = max(config['max_concurrent'], 1)
+        job_seconds = self.frames_per_job * self.seconds_per_frame
+        rounds = (self.active + self.waiting - slots) / slots + 1
+        return max(1, math.ceil(rounds * job_seconds))
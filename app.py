@@ -1,14 +1,21 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, Response, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, Response, jsonify, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.exc import IntegrityError
+import base64
 import hashlib
-import cv2
-import mediapipe as mp
-import numpy as np
+import json
 from datetime import datetime, timedelta
 import time
 import os
 import secrets
 import warnings
+from video_decode import VideoDecodeError, save_upload
+from rep_counting import EXERCISES, count_exercise, make_counter
+from landmark_payload import PayloadError, decode_payload
+from admission import AdmissionController, AdmissionRejected
+from jobs import JobCancelled, JobRegistry
+from pose_engine import PoseEngine
+from downsample import lttb
 warnings.filterwarnings("ignore")
 
 
@@ -18,15 +25,31 @@ app.secret_key = secrets.token_hex(16)
 if not os.path.exists('instance'):
     os.makedirs('instance')
 
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///fitness_tracker.db'
+# DATABASE_URI lets tests and load tests run against a scratch database
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URI', 'sqlite:///fitness_tracker.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(minutes=30)
 
 db = SQLAlchemy(app)
 
-# MediaPipe and OpenCV setup
-mp_drawing = mp.solutions.drawing_utils
-mp_pose = mp.solutions.pose
+# Limits on concurrent analyses, upload rates and sizes, reloaded from the
+# JSON file whenever it changes (see admission.py for the settings)
+admission = AdmissionController(os.environ.get('ADMISSION_CONFIG', 'admission.json'))
+
+# Running analyses, for progress streaming and cancellation
+jobs = JobRegistry()
+
+# Frames are downscaled while decoding; MediaPipe resizes to its own small
+# input anyway, so full-resolution phone uploads only cost decode time.
+DECODE_MAX_WIDTH = 640
+
+# MediaPipe Pose model tier per analysis, picked to fit the latency budget
+pose_engine = PoseEngine(max_width=DECODE_MAX_WIDTH)
+
+# Analysis progress streams
+SSE_INTERVAL = 0.25  # Seconds between progress events
+SSE_KEEPALIVE = 15
+SSE_JOB_WAIT = 10  # Seconds to wait for a job that has not been registered yet
 
 
 # Database Models
@@ -60,6 +83,10 @@ class PushUpsLog(db.Model):
     rest_period = db.Column(db.Integer, nullable=True)  # Rest period between sets in seconds
     calories_burned = db.Column(db.Float, nullable=True)  # Estimated calories burned
     form_notes = db.Column(db.String(255), nullable=True)  # Notes on form or technique
+    upload_key = db.Column(db.String(80), nullable=True)  # Idempotency key or content hash of the upload
+
+    # A retried upload can never be logged twice
+    __table_args__ = (db.Index('uq_push_ups_log_upload_key', 'user_id', 'upload_key', unique=True),)
 
 class SquatsLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -73,6 +100,10 @@ class SquatsLog(db.Model):
     calories_burned = db.Column(db.Float, nullable=True)
     depth = db.Column(db.String(50), nullable=True)  # Squat depth (e.g., "Parallel", "Below parallel")
     form_notes = db.Column(db.String(255), nullable=True)
+    upload_key = db.Column(db.String(80), nullable=True)  # Idempotency key or content hash of the upload
+
+    # A retried upload can never be logged twice
+    __table_args__ = (db.Index('uq_squats_log_upload_key', 'user_id', 'upload_key', unique=True),)
 
 class PlanksLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -83,6 +114,10 @@ class PlanksLog(db.Model):
     rest_period = db.Column(db.Integer, nullable=True)  # Rest period between plank holds
     calories_burned = db.Column(db.Float, nullable=True)
     form_notes = db.Column(db.String(255), nullable=True)
+    upload_key = db.Column(db.String(80), nullable=True)  # Idempotency key or content hash of the upload
+
+    # A retried upload can never be logged twice
+    __table_args__ = (db.Index('uq_planks_log_upload_key', 'user_id', 'upload_key', unique=True),)
 
 class LungesLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -96,6 +131,10 @@ class LungesLog(db.Model):
     calories_burned = db.Column(db.Float, nullable=True)
     stance = db.Column(db.String(50), nullable=True)  # E.g., Forward lunge, Reverse lunge
     form_notes = db.Column(db.String(255), nullable=True)
+    upload_key = db.Column(db.String(80), nullable=True)  # Idempotency key or content hash of the upload
+
+    # A retried upload can never be logged twice
+    __table_args__ = (db.Index('uq_lunges_log_upload_key', 'user_id', 'upload_key', unique=True),)
 
 class PullUpsLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -109,287 +148,149 @@ class PullUpsLog(db.Model):
     calories_burned = db.Column(db.Float, nullable=True)
     grip_type = db.Column(db.String(50), nullable=True)  # E.g., Overhand, Underhand, Neutral
     form_notes = db.Column(db.String(255), nullable=True)
+    upload_key = db.Column(db.String(80), nullable=True)  # Idempotency key or content hash of the upload
+
+    # A retried upload can never be logged twice
+    __table_args__ = (db.Index('uq_pull_ups_log_upload_key', 'user_id', 'upload_key', unique=True),)
+
+WORKOUT_LOG_MODELS = {
+    'pushups': PushUpsLog,
+    'squats': SquatsLog,
+    'planks': PlanksLog,
+    'lunges': LungesLog,
+    'pullups': PullUpsLog,
+}
+
+def upgrade_schema():
+    # db.create_all() does not touch existing tables, so databases created
+    # before upload keys existed get the column and unique index added here
+    inspector = db.inspect(db.engine)
+    with db.engine.begin() as connection:
+        for model in WORKOUT_LOG_MODELS.values():
+            table = model.__tablename__
+            columns = [column['name'] for column in inspector.get_columns(table)]
+            if 'upload_key' not in columns:
+                connection.execute(db.text(f"ALTER TABLE {table} ADD COLUMN upload_key VARCHAR(80)"))
+            connection.execute(db.text(
+                f"CREATE UNIQUE INDEX IF NOT EXISTS uq_{table}_upload_key ON {table} (user_id, upload_key)"))
+
+
+def analyze_video(exercise, video_path, user_notes, weight=None, job=None):
+    counter = make_counter(exercise, user_notes, weight)
+    frames = pose_engine.run(exercise, video_path, budget=admission.config()['latency_budget'],
+                             frame_count=job.total_frames if job is not None else None)
+    try:
+        for timestamp, landmarks in frames:
+            counter.update(timestamp, landmarks)
+            if job is not None:
+                # Publishes progress and stops here if the job was cancelled
+                job.advance(counter.reps)
+    finally:
+        frames.close()
+    return counter.result()
+
+def analyze_pushups_video(video_path, user_notes, job=None):
+    return analyze_video('pushups', video_path, user_notes, job=job)
+
+def analyze_squats_video(video_path, user_notes, weight, job=None):
+    return analyze_video('squats', video_path, user_notes, weight, job)
+
+def analyze_planks_video(video_path, user_notes, weight, job=None):
+    return analyze_video('planks', video_path, user_notes, weight, job)
+
+def analyze_lunges_video(video_path, user_notes, weight, job=None):
+    return analyze_video('lunges', video_path, user_notes, weight, job)
+
+def analyze_pullups_video(video_path, user_notes, job=None):
+    return analyze_video('pullups', video_path, user_notes, job=job)
+
+def save_workout_log(exercise, user_id, result, upload_key=None):
+    # Store the result of count_exercise() in the exercise's log table. If the
+    # upload was already logged, the existing row is returned instead.
+    if exercise == 'pushups':
+        reps, sets, duration, difficulty, rest_period, calories_burned, form_notes = result
+        log = PushUpsLog(user_id=user_id, date=datetime.now(), reps=reps, sets=sets, duration=duration,
+                         difficulty=difficulty, rest_period=rest_period, calories_burned=calories_burned,
+                         form_notes=form_notes, upload_key=upload_key)
+    elif exercise == 'squats':
+        reps, sets, duration, weight, calories_burned, rest_period, depth, form_notes = result
+        log = SquatsLog(user_id=user_id, date=datetime.now(), reps=reps, sets=sets, duration=duration,
+                        weight=weight, calories_burned=calories_burned, rest_period=rest_period,
+                        depth=depth, form_notes=form_notes, upload_key=upload_key)
+    elif exercise == 'planks':
+        duration, stage, rest_period, calories_burned, form_notes = result
+        log = PlanksLog(user_id=user_id, date=datetime.now(), duration=duration, stage=stage,
+                        rest_period=rest_period, calories_burned=calories_burned, form_notes=form_notes,
+                        upload_key=upload_key)
+    elif exercise == 'lunges':
+        reps, sets, duration, weight, calories_burned, rest_period, stance, form_notes = result
+        log = LungesLog(user_id=user_id, date=datetime.now(), reps=reps, sets=sets, duration=duration,
+                        weight=weight, calories_burned=calories_burned, rest_period=rest_period,
+                        stance=stance, form_notes=form_notes, upload_key=upload_key)
+    elif exercise == 'pullups':
+        reps, sets, duration, difficulty, calories_burned, rest_period, grip_type, form_notes = result
+        log = PullUpsLog(user_id=user_id, date=datetime.now(), reps=reps, sets=sets, duration=duration,
+                         difficulty=difficulty, rest_period=rest_period, calories_burned=calories_burned,
+                         grip_type=grip_type, form_notes=form_notes, upload_key=upload_key)
+    else:
+        raise ValueError(f"Unknown exercise: {exercise}")
 
-def analyze_pushups_video(video_path, user_notes):
-    # Initialize MediaPipe pose detection
-    mp_pose = mp.solutions.pose
-    pose = mp_pose.Pose(min_detection_confidence=0.5, min_tracking_confidence=0.5)
-    cap = cv2.VideoCapture(video_path)
-    
-    # Initialize form_notes with user-provided notes
-    form_notes = f"{user_notes}; "  # Keep user notes
-
-    reps = 0
-    sets = 0
-    in_pushup = False
-    start_time = datetime.now()
-    end_time = None
-    difficulty = "Beginner"
-    calories_burned = 0.0
-    rest_period = 0
-
-    # Process the video frame by frame
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        # Convert the frame to RGB
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        results = pose.process(frame_rgb)
-
-        if results.pose_landmarks:
-            # Logic for calculating pushups based on body landmarks
-            left_shoulder = results.pose_landmarks.landmark[mp_pose.PoseLandmark.LEFT_SHOULDER]
-            left_elbow = results.pose_landmarks.landmark[mp_pose.PoseLandmark.LEFT_ELBOW]
-            right_shoulder = results.pose_landmarks.landmark[mp_pose.PoseLandmark.RIGHT_SHOULDER]
-            right_elbow = results.pose_landmarks.landmark[mp_pose.PoseLandmark.RIGHT_ELBOW]
-
-            # Detect a push-up movement
-            if left_elbow.y < left_shoulder.y and right_elbow.y < right_shoulder.y:
-                if not in_pushup:
-                    reps += 1
-                    in_pushup = True
-            elif left_elbow.y > left_shoulder.y and right_elbow.y > right_shoulder.y:
-                in_pushup = False
-
-        end_time = datetime.now()
-
-    duration = (end_time - start_time).seconds if end_time and start_time else 0
-    sets = reps // 10  # Example: Every 10 reps make a new set
-
-    # Estimate calories burned
-    calories_burned = reps * 0.1  # Simplified formula
-
-    cap.release()
-
-    return reps, sets, duration, difficulty, rest_period, calories_burned, form_notes
-
-def analyze_squats_video(video_path, user_notes, weight):
-    mp_pose = mp.solutions.pose
-    pose = mp_pose.Pose(min_detection_confidence=0.5, min_tracking_confidence=0.5)
-    cap = cv2.VideoCapture(video_path)
-
-    reps = 0
-    sets = 1
-    weight = weight  # Example weight in kg
-    calories_burned = 0.0
-    rest_period = 0
-    depth = "Parallel"
-    form_notes = f"{user_notes}; "
-    in_squat = False
-    in_rest = False
-    start_time = datetime.now()
-    end_time = None
-    last_squat_time = datetime.now()
-
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        results = pose.process(frame_rgb)
-
-        if results.pose_landmarks:
-            left_hip = results.pose_landmarks.landmark[mp_pose.PoseLandmark.LEFT_HIP]
-            left_knee = results.pose_landmarks.landmark[mp_pose.PoseLandmark.LEFT_KNEE]
-            left_shoulder = results.pose_landmarks.landmark[mp_pose.PoseLandmark.LEFT_SHOULDER]
-
-            # Calculate depth of squat based on hip and knee positions
-            if left_hip.y > left_knee.y:
-                depth = "Above parallel"
-            elif left_hip.y < left_knee.y:
-                depth = "Below parallel"
-            else:
-                depth = "Parallel"
-
-            # Detect squat movement based on hip and knee
-            if left_hip.y > left_knee.y:
-                if not in_squat:
-                    reps += 1
-                    in_squat = True
-                    last_squat_time = datetime.now()
-            else:
-                in_squat = False
-
-            # Calculate rest period (time between sets)
-            if reps > 0 and (datetime.now() - last_squat_time).seconds > 10:  # example rest time threshold
-                in_rest = True
-                rest_period = (datetime.now() - last_squat_time).seconds
-            else:
-                in_rest = False
-                rest_period = 0
-
-        end_time = datetime.now()
-
-    duration = (end_time - start_time).seconds if end_time and start_time else 0
-    calories_burned = reps * 0.15  # Adjusted for squats
-
-    cap.release()
-    return reps, sets, duration, weight, calories_burned, rest_period, depth, form_notes
-
-def analyze_planks_video(video_path, user_notes, weight):
-    mp_pose = mp.solutions.pose
-    pose = mp_pose.Pose(min_detection_confidence=0.5, min_tracking_confidence=0.5)
-    cap = cv2.VideoCapture(video_path)
-
-    duration = 0
-    calories_burned = 0.0
-    rest_period = 0
-    form_notes = f"{user_notes}; "
-    stage = "Forearm plank"
-    start_time = datetime.now()
-    last_rest_time = datetime.now()
-    in_plank = False
-
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        results = pose.process(frame_rgb)
-
-        if results.pose_landmarks:
-            # Example: Identify pose for forearm vs. side plank
-            left_elbow = results.pose_landmarks.landmark[mp_pose.PoseLandmark.LEFT_ELBOW]
-            right_elbow = results.pose_landmarks.landmark[mp_pose.PoseLandmark.RIGHT_ELBOW]
-            
-            if left_elbow.visibility > 0.5 and right_elbow.visibility > 0.5:
-                in_plank = True
-                stage = "Forearm plank"
-            else:
-                in_plank = False
-                stage = "Side plank"
-
-        duration = (datetime.now() - start_time).seconds
-        rest_period = (datetime.now() - last_rest_time).seconds if not in_plank else 0
-        calories_burned = duration * 0.12  # Calories burned estimate
-
-    cap.release()
-    return duration, stage, rest_period, calories_burned, form_notes
-
-def analyze_lunges_video(video_path, user_notes, weight):
-    mp_pose = mp.solutions.pose
-    pose = mp_pose.Pose(min_detection_confidence=0.5, min_tracking_confidence=0.5)
-    cap = cv2.VideoCapture(video_path)
-
-    reps = 0
-    sets = 1
-    weight = weight  # Example weight in kg
-    calories_burned = 0.0
-    rest_period = 0
-    stance = "Forward Lunge"
-    form_notes = f"{user_notes}; "
-    in_lunge = False
-    in_rest = False
-    start_time = datetime.now()
-    end_time = None
-    last_lunge_time = datetime.now()
-
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        results = pose.process(frame_rgb)
-
-        if results.pose_landmarks:
-            left_hip = results.pose_landmarks.landmark[mp_pose.PoseLandmark.LEFT_HIP]
-            left_knee = results.pose_landmarks.landmark[mp_pose.PoseLandmark.LEFT_KNEE]
-            left_shoulder = results.pose_landmarks.landmark[mp_pose.PoseLandmark.LEFT_SHOULDER]
-
-            # Detect lunge stance based on leg position
-            if left_hip.x > left_knee.x:
-                stance = "Forward Lunge"
-            else:
-                stance = "Reverse Lunge"
-
-            # Detect lunge movement based on knee angle
-            if left_knee.y < left_hip.y:  # Indicates a lunge
-                if not in_lunge:
-                    reps += 1
-                    in_lunge = True
-                    last_lunge_time = datetime.now()
-            else:
-                in_lunge = False
-
-            # Calculate rest period (time between sets)
-            if reps > 0 and (datetime.now() - last_lunge_time).seconds > 10:  # Example rest time threshold
-                in_rest = True
-                rest_period = (datetime.now() - last_lunge_time).seconds
-            else:
-                in_rest = False
-                rest_period = 0
-
-        end_time = datetime.now()
-
-    duration = (end_time - start_time).seconds if end_time and start_time else 0
-    calories_burned = reps * 0.2  # Adjusted for lunges
-
-    cap.release()
-    return reps, sets, duration, weight, calories_burned, rest_period, stance, form_notes
-
-def analyze_pullups_video(video_path, user_notes):
-    mp_pose = mp.solutions.pose
-    pose = mp_pose.Pose(min_detection_confidence=0.5, min_tracking_confidence=0.5)
-    cap = cv2.VideoCapture(video_path)
-    
-    form_notes = f"{user_notes}; "
-
-    reps = 0
-    sets = 1
-    duration = 0
-    difficulty = "Moderate"  # Default difficulty level
-    calories_burned = 0.0
-    rest_period = 0
-    grip_type = "Neutral"  # Default grip type
-    in_pull = False
-    start_time = datetime.now()
-    end_time = None
-    last_pull_time = datetime.now()
-
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        results = pose.process(frame_rgb)
-
-        if results.pose_landmarks:
-            left_wrist = results.pose_landmarks.landmark[mp_pose.PoseLandmark.LEFT_WRIST]
-            left_elbow = results.pose_landmarks.landmark[mp_pose.PoseLandmark.LEFT_ELBOW]
-            left_shoulder = results.pose_landmarks.landmark[mp_pose.PoseLandmark.LEFT_SHOULDER]
-
-            # Detect pull-up movement
-            if left_wrist.y < left_elbow.y < left_shoulder.y:
-                if not in_pull:
-                    reps += 1
-                    in_pull = True
-                    last_pull_time = datetime.now()
-            else:
-                in_pull = False
-
-            # Calculate rest period
-            if reps > 0 and (datetime.now() - last_pull_time).seconds > 10:
-                rest_period = (datetime.now() - last_pull_time).seconds
-
-        end_time = datetime.now()
-
-    duration = (end_time - start_time).seconds if end_time and start_time else 0
-    calories_burned = reps * 0.12  # Adjusted for pull-ups
-
-    cap.release()
-    return reps, sets, duration, difficulty, calories_burned, rest_period, grip_type, form_notes
+    db.session.add(log)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent request logged the same upload first
+        db.session.rollback()
+        existing = find_workout_log(exercise, user_id, upload_key)
+        if existing is None:
+            raise
+        return existing
+    return log
+
+def find_workout_log(exercise, user_id, upload_key):
+    if upload_key is None:
+        return None
+    return WORKOUT_LOG_MODELS[exercise].query.filter_by(user_id=user_id, upload_key=upload_key).first()
+
+def idempotency_key():
+    # The Idempotency-Key clients send with each recording, if any. Only the
+    # header can be read before the upload body is admitted.
+    key = request.headers.get('Idempotency-Key')
+    return 'key:' + key[:72] if key else None
+
+def upload_key_for(stream):
+    # Without an Idempotency-Key, the content hash of the upload identifies
+    # retries of the same file
+    key = request.form.get('idempotency_key')
+    if key:
+        return 'key:' + key[:72]
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(1024 * 1024), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    return 'sha256:' + digest.hexdigest()
 
 
 # Hash password
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
+@app.errorhandler(AdmissionRejected)
+def admission_rejected(e):
+    response = jsonify({"status": "error", "message": e.message})
+    response.status_code = e.status
+    if e.retry_after is not None:
+        response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+@app.errorhandler(VideoDecodeError)
+def video_not_decodable(e):
+    return jsonify({"status": "error", "message": str(e)}), 400
+
+@app.errorhandler(JobCancelled)
+def analysis_cancelled(e):
+    return jsonify({"status": "cancelled", "message": "Analysis cancelled"}), 409
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -517,147 +418,366 @@ def pullups_video():
 
 
 
+# Recording settings handed to the capture pages. Pose counting needs far less
+# than phones record by default: frames are analyzed at DECODE_MAX_WIDTH or
+# below, and reps are slow enough to follow at 12-15 fps. Planks are a static
+# hold, so they get the fewest frames.
+CAPTURE_PROFILES = {
+    'pushups': {'width': 640, 'height': 480, 'frameRate': 15},
+    'squats': {'width': 640, 'height': 480, 'frameRate': 15},
+    'planks': {'width': 480, 'height': 360, 'frameRate': 8},
+    'lunges': {'width': 640, 'height': 480, 'frameRate': 15},
+    'pullups': {'width': 640, 'height': 480, 'frameRate': 15},
+}
+# Used once the analysis queue is full (admission load >= 1)
+BUSY_CAPTURE_PROFILE = {'width': 480, 'height': 360, 'frameRate': 10}
+CAPTURE_BITS_PER_PIXEL = 0.1
+# VP8 is the cheapest of these to decode, MP4 is for Safari
+CAPTURE_MIME_TYPES = ['video/webm;codecs=vp8', 'video/webm;codecs=vp9', 'video/webm', 'video/mp4']
+
+def capture_profile_for(exercise, load):
+    profile = dict(CAPTURE_PROFILES[exercise])
+    if load >= 1:
+        for key, value in BUSY_CAPTURE_PROFILE.items():
+            profile[key] = min(profile[key], value)
+    pixels_per_second = profile['width'] * profile['height'] * profile['frameRate']
+    profile['videoBitsPerSecond'] = int(pixels_per_second * CAPTURE_BITS_PER_PIXEL)
+    profile['mimeTypes'] = CAPTURE_MIME_TYPES
+    return profile
+
+@app.route('/capture_profile/<exercise>')
+def capture_profile(exercise):
+    if exercise not in CAPTURE_PROFILES:
+        return jsonify({"status": "error", "message": "Invalid exercise"}), 404
+    return jsonify(capture_profile_for(exercise, admission.load()))
+
+UPLOAD_DIR = 'captured_videos'  # Uploads are kept here only while they are analyzed
+
+DUPLICATE_UPLOAD_MESSAGE = "Video was already analyzed, returning the saved result."
+LANDMARKS_DUPLICATE_MESSAGE = "Landmarks were already analyzed."
+
+def duplicate_upload(log, message=DUPLICATE_UPLOAD_MESSAGE):
+    # A retry is answered with the log saved for the original upload
+    return jsonify({"status": "success", "message": message, "duplicate": True, "log": api_log(log)})
+
+def retried_upload(exercise, user_id, upload_key):
+    # The response for a retry of an upload that is already logged or still
+    # being analyzed, None for a new upload
+    log = find_workout_log(exercise, user_id, upload_key)
+    if log is not None:
+        return duplicate_upload(log)
+    job = jobs.running(user_id, upload_key)
+    if job is None:
+        return None
+    jobs.alias(request.form.get('job_id'), job)
+    return wait_for_upload(exercise, user_id, upload_key, job)
+
+def wait_for_upload(exercise, user_id, upload_key, job):
+    # Answer a retry with the result of the running job analyzing its upload
+    job.wait_finished()
+    log = find_workout_log(exercise, user_id, upload_key)
+    if log is None:
+        return jsonify({"status": "error", "message": f"Original upload was {job.state}, try again"}), 409
+    return duplicate_upload(log)
+
+def capture_upload(exercise, video_name, analyze):
+    # Shared by the /capture_video/* routes: admission control, duplicate
+    # detection, progress tracking, analysis and logging.
+    # analyze(video_path, job) returns the exercise's count_exercise() result.
+    if 'user_id' not in session:
+        return jsonify({"status": "error", "message": "Login required"}), 401
+    user_id = session['user_id']
+
+    # Retries that carry an Idempotency-Key are answered without taking a
+    # rate limit token or a queue place
+    upload_key = idempotency_key()
+    if upload_key is not None:
+        response = retried_upload(exercise, user_id, upload_key)
+        if response is not None:
+            return response
+
+    with admission.admit(user_id, request.content_length) as ticket:
+        video_file = request.files['video']
+        if upload_key is None:
+            upload_key = upload_key_for(video_file.stream)
+            log = find_workout_log(exercise, user_id, upload_key)
+            if log is not None:
+                return duplicate_upload(log)
+
+        tracked = jobs.track(request.form.get('job_id'), user_id, exercise, upload_key)
+        if tracked.attached:
+            # The original upload started in the meantime, wait for it
+            # without holding a queue place
+            ticket.release()
+            return wait_for_upload(exercise, user_id, upload_key, tracked.job)
+        with tracked as job:
+            # Every upload gets its own file, other requests for the same
+            # exercise may still be decoding theirs
+            video_path = save_upload(video_file, os.path.join(UPLOAD_DIR, f"{video_name}_{secrets.token_hex(8)}"))
+            try:
+                info = ticket.start_analysis(video_path, job.cancel_requested)
+                job.start(info.frame_count)
+                log = save_workout_log(exercise, user_id, analyze(video_path, job), upload_key)
+            finally:
+                os.remove(video_path)
+
+    return jsonify({"status": "success", "message": "Video analyzed and data saved successfully!", "log": api_log(log)})
+
 @app.route('/capture_video/pushups', methods=['POST'])
 def capture_video():
-    video_file = request.files['video']
-    user_notes = request.form.get('notes', '')
-    video_path = 'captured_videos/exercise_video.mp4'
-    os.makedirs('captured_videos', exist_ok=True)
-    video_file.save(video_path)
-    
-    # Analyze the video for pushups
-    reps, sets, duration, difficulty, rest_period, calories_burned, form_notes = analyze_pushups_video(video_path, user_notes)
-    
-    # Store the results in the database
-    new_pushup_log = PushUpsLog(
-        user_id=session['user_id'],  # Example user ID
-        date=datetime.now(),
-        reps=reps,
-        sets=sets,
-        duration=duration,
-        difficulty=difficulty,
-        rest_period=rest_period,
-        calories_burned=calories_burned,
-        form_notes=form_notes
-    )
-    
-    db.session.add(new_pushup_log)
-    db.session.commit()
-    
-    return jsonify({"status": "success", "message": "Video analyzed and data saved successfully!"})
+    # Analyze the video for pushups and store the results in the database
+    return capture_upload('pushups', 'exercise_video', lambda video_path, job: analyze_pushups_video(
+        video_path, request.form.get('notes', ''), job))
 
 @app.route('/capture_video/squats', methods=['POST'])
 def capture_squats_video():
-    video_file = request.files['video']
-    user_notes = request.form.get('notes', '')
-    user_weight = request.form.get('weight', '')
-    video_path = 'captured_videos/squats_video.mp4'
-    os.makedirs('captured_videos', exist_ok=True)
-    video_file.save(video_path)
-    
-    reps, sets, duration, weight, calories_burned, rest_period, depth, form_notes = analyze_squats_video(video_path, user_notes, user_weight)
-
-    new_squat_log = SquatsLog(
-        user_id=session['user_id'],
-        date=datetime.now(),
-        reps=reps,
-        sets=sets,
-        duration=duration,
-        weight=weight,
-        calories_burned=calories_burned,
-        rest_period=rest_period,
-        depth=depth,
-        form_notes=form_notes
-    )
-    
-    db.session.add(new_squat_log)
-    db.session.commit()
-
-    return jsonify({"status": "success", "message": "Video analyzed and data saved successfully!"})
+    return capture_upload('squats', 'squats_video', lambda video_path, job: analyze_squats_video(
+        video_path, request.form.get('notes', ''), request.form.get('weight', ''), job))
 
 
 @app.route('/capture_video/planks', methods=['POST'])
 def capture_planks_video():
-    video_file = request.files['video']
-    user_notes = request.form.get('notes', '')
-    user_weight = request.form.get('weight', '')
-    video_path = 'captured_videos/planks_video.mp4'
-    os.makedirs('captured_videos', exist_ok=True)
-    video_file.save(video_path)
-
-    duration, stage, rest_period, calories_burned, form_notes = analyze_planks_video(video_path, user_notes, user_weight)
-
-    new_plank_log = PlanksLog(
-        user_id=session['user_id'],
-        date=datetime.now(),
-        duration=duration,
-        stage=stage,
-        rest_period=rest_period,
-        calories_burned=calories_burned,
-        form_notes=form_notes
-    )
-    
-    db.session.add(new_plank_log)
-    db.session.commit()
-
-    return jsonify({"status": "success", "message": "Video analyzed and data saved successfully!"})
+    return capture_upload('planks', 'planks_video', lambda video_path, job: analyze_planks_video(
+        video_path, request.form.get('notes', ''), request.form.get('weight', ''), job))
 
 
 @app.route('/capture_video/lunges', methods=['POST'])
 def capture_lunges_video():
-    video_file = request.files['video']
-    user_notes = request.form.get('notes', '')
-    user_weight = request.form.get('weight', '')
-    video_path = 'captured_videos/lunges_video.mp4'
-    os.makedirs('captured_videos', exist_ok=True)
-    video_file.save(video_path)
-
-    reps, sets, duration, weight, calories_burned, rest_period, stance, form_notes = analyze_lunges_video(video_path, user_notes, user_weight)
-
-    new_lunges_log = LungesLog(
-        user_id=session['user_id'],
-        date=datetime.now(),
-        reps=reps,
-        sets=sets,
-        duration=duration,
-        weight=weight,
-        calories_burned=calories_burned,
-        rest_period=rest_period,
-        stance=stance,
-        form_notes=form_notes
-    )
-
-    db.session.add(new_lunges_log)
-    db.session.commit()
-
-    return jsonify({"status": "success", "message": "Video analyzed and data saved successfully!"})
+    return capture_upload('lunges', 'lunges_video', lambda video_path, job: analyze_lunges_video(
+        video_path, request.form.get('notes', ''), request.form.get('weight', ''), job))
 
 @app.route('/capture_video/pullups', methods=['POST'])
 def capture_pullups_video():
-    video_file = request.files['video']
-    user_notes = request.form.get('notes', '')
-    video_path = 'captured_videos/pullups_video.mp4'
-    os.makedirs('captured_videos', exist_ok=True)
-    video_file.save(video_path)
-
-    reps, sets, duration, difficulty, calories_burned, rest_period, grip_type, form_notes = analyze_pullups_video(video_path, user_notes)
-    new_pullups_log = PullUpsLog(
-        user_id=session['user_id'],
-        date=datetime.now(),
-        reps=reps,
-        sets=sets,
-        duration=duration,
-        difficulty=difficulty,
-        rest_period=rest_period,
-        calories_burned=calories_burned,
-        grip_type=grip_type,
-        form_notes=form_notes
-    )
-    
-    db.session.add(new_pullups_log)
-    db.session.commit()
+    return capture_upload('pullups', 'pullups_video', lambda video_path, job: analyze_pullups_video(
+        video_path, request.form.get('notes', ''), job))
+
+@app.route('/capture_landmarks/<exercise>', methods=['POST'])
+def capture_landmarks(exercise):
+    # Same counting and logging as /capture_video/<exercise>, but the browser
+    # already ran pose detection and uploads only the landmarks
+    # (see landmark_payload.py for the format).
+    if 'user_id' not in session:
+        return jsonify({"status": "error", "message": "Login required"}), 401
+    if exercise not in EXERCISES:
+        return jsonify({"status": "error", "message": "Invalid exercise"}), 404
+
+    # Retries that carry an Idempotency-Key are answered before the limits
+    upload_key = idempotency_key()
+    log = find_workout_log(exercise, session['user_id'], upload_key)
+    if log is not None:
+        return duplicate_upload(log, LANDMARKS_DUPLICATE_MESSAGE)
+
+    # Counting landmarks is cheap, so only the size and rate limits apply
+    with admission.admit(session['user_id'], request.content_length, queued=False):
+        if 'landmarks' not in request.files:
+            return jsonify({"status": "error", "message": "Missing landmarks payload"}), 400
+        user_notes = request.form.get('notes', '')
+        user_weight = request.form.get('weight', '')
+        landmarks_file = request.files['landmarks']
+        if upload_key is None:
+            upload_key = upload_key_for(landmarks_file.stream)
+            log = find_workout_log(exercise, session['user_id'], upload_key)
+            if log is not None:
+                return duplicate_upload(log, LANDMARKS_DUPLICATE_MESSAGE)
+        try:
+            frames = decode_payload(landmarks_file.read())
+        except PayloadError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+
+        log = save_workout_log(exercise, session['user_id'],
+                               count_exercise(exercise, frames, user_notes, user_weight), upload_key)
+
+    return jsonify({"status": "success", "message": "Landmarks analyzed and data saved successfully!",
+                    "log": api_log(log)})
+
+@app.route('/analysis/<job_id>/events')
+def analysis_events(job_id):
+    # Server-Sent Events stream of an analysis' progress, until it finishes
+    if 'user_id' not in session:
+        return jsonify({"status": "error", "message": "Login required"}), 401
+    user_id = session['user_id']
 
-    return jsonify({"status": "success", "message": "Video analyzed and data saved successfully!"})
+    def stream():
+        # The page subscribes right after starting the upload, so the job
+        # may not have been registered yet
+        deadline = time.monotonic() + SSE_JOB_WAIT
+        job = jobs.get(job_id, user_id)
+        while job is None and time.monotonic() < deadline:
+            yield ": waiting\n\n"
+            time.sleep(0.5)
+            job = jobs.get(job_id, user_id)
+        if job is None:
+            yield "event: error\ndata: {\"message\": \"Unknown analysis\"}\n\n"
+            return
+
+        version = None
+        while True:
+            if job.version == version:
+                yield ": keepalive\n\n"
+            else:
+                version = job.version
+                yield f"data: {json.dumps(job.status())}\n\n"
+            if job.is_finished:
+                return
+            time.sleep(SSE_INTERVAL)  # Coalesce per-frame updates
+            job.wait_for_change(version, SSE_KEEPALIVE)
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/analysis/<job_id>/cancel', methods=['POST'])
+def cancel_analysis(job_id):
+    if 'user_id' not in session:
+        return jsonify({"status": "error", "message": "Login required"}), 401
+    job = jobs.get(job_id, session['user_id'])
+    if job is None:
+        return jsonify({"status": "error", "message": "Unknown analysis"}), 404
+    job.cancel()
+    return jsonify({"status": "success", "message": "Cancellation requested"})
+
+# JSON API over the workout logs for clients that keep a local copy.
+# /api/logs returns the logs added after the cursor from the previous call,
+# so a client only ever downloads each log once; /api/series/<metric> returns
+# per-day totals, downsampled for charts.
+API_LOG_LIMIT = 100  # Logs per exercise per response
+API_MAX_LOG_LIMIT = 500
+API_SERIES_POINTS = 200
+API_MAX_SERIES_POINTS = 1000
+API_HIDDEN_FIELDS = ('user_id', 'upload_key')
+SERIES_METRICS = ('reps', 'calories_burned', 'duration')
+
+def encode_cursor(last_ids):
+    return base64.urlsafe_b64encode(json.dumps(last_ids, separators=(',', ':')).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    # Cursors are opaque to clients: the last log id returned per exercise
+    try:
+        last_ids = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    if not isinstance(last_ids, dict) or not all(
+            exercise in WORKOUT_LOG_MODELS and type(last_id) is int for exercise, last_id in last_ids.items()):
+        raise ValueError("Invalid cursor")
+    return last_ids
+
+def api_exercises():
+    exercises = request.args.get('exercise')
+    if not exercises:
+        return list(WORKOUT_LOG_MODELS)
+    exercises = exercises.split(',')
+    for exercise in exercises:
+        if exercise not in WORKOUT_LOG_MODELS:
+            raise ValueError(f"Invalid exercise: {exercise}")
+    return exercises
+
+def api_int(name, default, low, high):
+    try:
+        value = int(request.args.get(name, default))
+    except ValueError:
+        raise ValueError(f"{name} must be a number")
+    if not low <= value <= high:
+        raise ValueError(f"{name} must be between {low} and {high}")
+    return value
+
+def api_since():
+    if 'since' not in request.args:
+        return None
+    try:
+        return datetime.fromisoformat(request.args['since'])
+    except ValueError:
+        raise ValueError("since must be an ISO 8601 date or time")
+
+def api_fields(exercises):
+    public = {exercise: [column.name for column in WORKOUT_LOG_MODELS[exercise].__table__.columns
+                         if column.name not in API_HIDDEN_FIELDS] for exercise in exercises}
+    if 'fields' not in request.args:
+        return public
+    fields = request.args['fields'].split(',')
+    for field in fields:
+        if not any(field in columns for columns in public.values()):
+            raise ValueError(f"Unknown field: {field}")
+    # Fields an exercise does not have (e.g. reps for planks) are left out
+    return {exercise: ['id'] + [field for field in fields if field in columns and field != 'id']
+            for exercise, columns in public.items()}
+
+def api_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def api_row(row):
+    return {key: api_value(value) for key, value in row._asdict().items()}
+
+def api_log(log):
+    # A saved log with the public fields /api/logs returns
+    return {column.name: api_value(getattr(log, column.name)) for column in log.__table__.columns
+            if column.name not in API_HIDDEN_FIELDS}
+
+@app.route('/api/logs')
+def api_logs():
+    # ?cursor=  logs after the cursor returned by the previous call
+    # ?since=   logs dated after an ISO time, for a first sync of recent history
+    # ?exercise=squats,planks  ?fields=date,reps  ?limit=
+    if 'user_id' not in session:
+        return jsonify({"status": "error", "message": "Login required"}), 401
+    try:
+        exercises = api_exercises()
+        fields = api_fields(exercises)
+        last_ids = decode_cursor(request.args['cursor']) if 'cursor' in request.args else {}
+        since = api_since()
+        limit = api_int('limit', API_LOG_LIMIT, 1, API_MAX_LOG_LIMIT)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    logs = {}
+    has_more = False
+    for exercise in exercises:
+        model = WORKOUT_LOG_MODELS[exercise]
+        query = db.session.query(*[getattr(model, field) for field in fields[exercise]]).filter(
+            model.user_id == session['user_id'], model.id > last_ids.get(exercise, 0))
+        if since is not None:
+            query = query.filter(model.date > since)
+        rows = query.order_by(model.id).limit(limit + 1).all()
+        if len(rows) > limit:
+            has_more = True
+            rows = rows[:limit]
+        logs[exercise] = [api_row(row) for row in rows]
+        if rows:
+            last_ids[exercise] = rows[-1].id
+
+    return jsonify({"status": "success", "logs": logs, "cursor": encode_cursor(last_ids), "hasMore": has_more})
+
+@app.route('/api/series/<metric>')
+def api_series(metric):
+    # Daily totals of reps, calories_burned or duration over the selected
+    # exercises, reduced to ?points= with LTTB
+    if 'user_id' not in session:
+        return jsonify({"status": "error", "message": "Login required"}), 401
+    if metric not in SERIES_METRICS:
+        return jsonify({"status": "error", "message": "Invalid metric"}), 404
+    try:
+        exercises = api_exercises()
+        since = api_since()
+        points = api_int('points', API_SERIES_POINTS, 3, API_MAX_SERIES_POINTS)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    totals = {}
+    for exercise in exercises:
+        model = WORKOUT_LOG_MODELS[exercise]
+        if metric not in model.__table__.columns:
+            continue
+        day = db.func.date(model.date)
+        query = db.session.query(day, db.func.sum(getattr(model, metric))).filter(model.user_id == session['user_id'])
+        if since is not None:
+            query = query.filter(model.date > since)
+        for date, total in query.group_by(day):
+            date = date if isinstance(date, str) else date.isoformat()
+            totals[date] = totals.get(date, 0) + (total or 0)
+
+    days = sorted(totals)
+    values = [totals[day] for day in days]
+    kept = lttb([datetime.fromisoformat(day).toordinal() for day in days], values, points)
+    return jsonify({"status": "success", "metric": metric, "days": len(days),
+                    "points": [{"date": days[i], "value": values[i]} for i in kept]})
 
 @app.route('/about')
 def about():
@@ -702,4 +822,5 @@ def contact():
 if __name__ == "__main__":
     with app.app_context():
         db.create_all()
+        upgrade_schema()
     app.run(debug=True)
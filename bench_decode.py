@@ -0,0 +1,49 @@
+import argparse
+import glob
+import time
+
+from video_decode import av, probe_video, read_frames
+
+# Decode throughput of the upload decode layer on the clips in reference_clips/
+#
+#   python bench_decode.py
+#   python bench_decode.py --widths 0 640 320 --repeat 3 reference_clips/squats.mkv
+
+
+def bench(video_path, backend, max_width, repeat):
+    best = None
+    frames = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        frames = 0
+        for timestamp, frame in read_frames(video_path, max_width=max_width, backend=backend):
+            frames += 1
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return frames, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark video decode throughput")
+    parser.add_argument('videos', nargs='*', help="clips to decode (default: reference_clips/*)")
+    parser.add_argument('--widths', nargs='+', type=int, default=[0, 640, 320],
+                        help="max decode widths to try, 0 means native resolution")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per case, the best one is reported")
+    args = parser.parse_args()
+
+    videos = args.videos or sorted(glob.glob('reference_clips/*'))
+    backends = ['opencv'] + (['pyav'] if av is not None else [])
+
+    print(f"{'clip':<40} {'container/codec':<16} {'backend':<8} {'width':>6} {'frames':>7} {'seconds':>8} {'fps':>8}")
+    for video_path in videos:
+        info = probe_video(video_path)
+        label = f"{info.container}/{info.codec}"
+        for backend in backends:
+            for width in args.widths:
+                frames, elapsed = bench(video_path, backend, width or None, args.repeat)
+                fps = frames / elapsed if elapsed else 0.0
+                print(f"{video_path:<40} {label:<16} {backend:<8} {width or 'native':>6} {frames:>7} {elapsed:>8.3f} {fps:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import argparse
+import json
+
+import numpy as np
+
+from pose_engine import ACCURACY_PROFILES, MODEL_LOAD_ERRORS, MODEL_TIERS, PoseEngine
+from rep_counting import make_counter
+
+# Accuracy versus cost of the pose model tiers on reference clips
+#
+#   python bench_pose.py
+#   python bench_pose.py --budget 10 --labels reference_reps.json reference_clips/squats.mkv:squats
+#
+# Every clip runs on each model tier, then once through the scheduler with the
+# given latency budget ("auto"). Accuracy is measured against the expected rep
+# count from --labels ({"clip path": reps}) when there is one, otherwise against
+# the heaviest tier that could be loaded: the difference in counted reps, and
+# the mean distance of the exercise's key landmarks in normalized image
+# coordinates. Planks are counted in seconds held instead of reps.
+
+REFERENCE_CLIPS = {
+    'reference_clips/pushups.mkv': 'pushups',
+    'reference_clips/squats.mkv': 'squats',
+    'reference_clips/planks.mkv': 'planks',
+    'reference_clips/lunges.mkv': 'lunges',
+    'reference_clips/pullups.mkv': 'pullups',
+}
+
+
+def measure(engine, exercise, video_path, tier=None, budget=None):
+    run = engine.run(exercise, video_path, budget=budget, tier=tier)
+    counter = make_counter(exercise, '')
+    frames = []
+    try:
+        for timestamp, landmarks in run:
+            counter.update(timestamp, landmarks)
+            if landmarks is not None:
+                landmarks = [(l.x, l.y, l.visibility) for l in landmarks]
+            frames.append(landmarks)
+    finally:
+        run.close()
+
+    key_landmarks = ACCURACY_PROFILES[exercise]['key_landmarks']
+    detected = [f for f in frames if f is not None]
+    visibility = [min(f[i][2] for i in key_landmarks) for f in detected]
+    return {
+        'tier': run.tier,
+        'frames': run.frames,
+        'escalated': run.escalated_frames,
+        'seconds': run.elapsed,
+        'msPerFrame': run.elapsed * 1000 / max(run.frames, 1),
+        'detected': len(detected) / max(len(frames), 1),
+        'keyVisibility': float(np.mean(visibility)) if visibility else 0.0,
+        'count': counter.duration if exercise == 'planks' else counter.reps,
+        'landmarks': frames,
+    }
+
+
+def landmark_error(frames, reference, key_landmarks):
+    distances = [np.hypot(a[i][0] - b[i][0], a[i][1] - b[i][1])
+                 for a, b in zip(frames, reference) if a is not None and b is not None
+                 for i in key_landmarks]
+    return float(np.mean(distances)) if distances else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare pose model tiers on reference clips")
+    parser.add_argument('clips', nargs='*', help="PATH:EXERCISE pairs (default: the clips in reference_clips/)")
+    parser.add_argument('--budget', type=float, default=60, help="latency budget in seconds for the auto run")
+    parser.add_argument('--labels', help="JSON file of expected rep counts per clip")
+    parser.add_argument('--max-width', type=int, default=640, help="decode width, as in the app")
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+
+    clips = dict(clip.rsplit(':', 1) for clip in args.clips) if args.clips else REFERENCE_CLIPS
+    labels = {}
+    if args.labels:
+        with open(args.labels) as f:
+            labels = json.load(f)
+
+    engine = PoseEngine(max_width=args.max_width)
+    report = []
+    print(f"{'clip':<36} {'exercise':<8} {'run':<6} {'tier':<6} {'ms/frame':>8} {'escal.':>6} {'detect':>6} "
+          f"{'key vis':>7} {'count':>5} {'error':>5} {'lm err':>6}")
+    for video_path, exercise in clips.items():
+        results = {}
+        for tier in engine.available_tiers():
+            try:
+                results[tier] = measure(engine, exercise, video_path, tier=tier)
+            except MODEL_LOAD_ERRORS as e:
+                engine.mark_unavailable(tier, e)
+        results['auto'] = measure(engine, exercise, video_path, budget=args.budget)
+
+        heaviest = [tier for tier in MODEL_TIERS if tier in results][-1]
+        reference = results[heaviest]
+        expected = labels.get(video_path, reference['count'])
+        key_landmarks = ACCURACY_PROFILES[exercise]['key_landmarks']
+        for result in results.values():
+            result['error'] = abs(result['count'] - expected)
+            result['landmarkError'] = landmark_error(result['landmarks'], reference['landmarks'], key_landmarks)
+        for name, result in results.items():
+            lm_error = f"{result['landmarkError']:.4f}" if result['landmarkError'] is not None else '-'
+            print(f"{video_path:<36} {exercise:<8} {name:<6} {result['tier']:<6} {result['msPerFrame']:>8.1f} "
+                  f"{result['escalated']:>6} {result['detected'] * 100:>5.0f}% {result['keyVisibility']:>7.2f} "
+                  f"{result['count']:>5} {result['error']:>5} {lm_error:>6}")
+            del result['landmarks']
+            report.append(dict(result, clip=video_path, exercise=exercise, run=name, expected=expected))
+
+    missing = [tier for tier in MODEL_TIERS if not engine.installed(tier)]
+    if missing:
+        print(f"\nNot measured, fetch with `python pose_engine.py fetch` first: {', '.join(missing)}")
+    if engine.unavailable:
+        print(f"\nNot measured, model could not be loaded: {', '.join(sorted(engine.unavailable))}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import argparse
+import json
+import math
+
+import numpy as np
+
+from bench_pose import REFERENCE_CLIPS
+from pose_engine import MODEL_LOAD_ERRORS, PoseEngine
+from rep_counting import (LEFT_ELBOW, LEFT_HIP, LEFT_KNEE, LEFT_SHOULDER, LEFT_WRIST, NUM_LANDMARKS, RIGHT_ELBOW,
+                          RIGHT_HIP, RIGHT_KNEE, RIGHT_SHOULDER, RIGHT_WRIST, Landmark, make_counter,
+                          make_unfiltered_counter)
+
+# Rep counting accuracy on labeled clips, with and without landmark filtering
+#
+#   python bench_reps.py
+#   python bench_reps.py --labels reference_reps.json --strides 1 2 3 5 reference_clips/lunges.mkv:lunges
+#
+# Pose landmarks are extracted once per clip and model tier, then counted at
+# every --strides sampling rate (every frame, every 2nd frame, ...) by the
+# unfiltered counters (raw landmarks and a single threshold, as before) and by
+# the filtered ones. Synthetic landmark streams with a known number of reps,
+# landmark jitter and occluded joints are counted the same way.
+#
+# reference_reps.json holds hand-counted reps for the clips in reference_clips/.
+# All of them show no reps, so they only catch phantom reps; missed reps are
+# only measured on the synthetic streams.
+
+REP_EXERCISES = ('pushups', 'squats', 'lunges', 'pullups')  # Planks are timed, not counted
+
+SYNTHETIC_FPS = 30
+SYNTHETIC_PERIOD = 2.0  # Seconds per rep
+SYNTHETIC_AMPLITUDE = 0.08  # Peak margin past each counter's threshold, in normalized units
+SYNTHETIC_KEY_LANDMARKS = {
+    'pushups': (LEFT_SHOULDER, RIGHT_SHOULDER, LEFT_ELBOW, RIGHT_ELBOW),
+    'squats': (LEFT_HIP, LEFT_KNEE),
+    'lunges': (LEFT_HIP, LEFT_KNEE),
+    'pullups': (LEFT_WRIST, LEFT_ELBOW, LEFT_SHOULDER),
+}
+
+
+def synthetic_pose(exercise, margin):
+    # A pose whose counter margin (see rep_counting) is `margin`
+    points = np.full((NUM_LANDMARKS, 2), 0.5)
+    if exercise == 'pushups':
+        points[[LEFT_SHOULDER, RIGHT_SHOULDER], 1] = 0.5
+        points[[LEFT_ELBOW, RIGHT_ELBOW], 1] = 0.5 - margin
+    elif exercise in ('squats', 'lunges'):
+        points[[LEFT_KNEE, RIGHT_KNEE], 1] = 0.6
+        points[[LEFT_HIP, RIGHT_HIP], 1] = 0.6 + margin
+    elif exercise == 'pullups':
+        points[[LEFT_SHOULDER, RIGHT_SHOULDER], 1] = 0.5
+        points[[LEFT_ELBOW, RIGHT_ELBOW], 1] = 0.5 - margin
+        points[[LEFT_WRIST, RIGHT_WRIST], 1] = 0.5 - 2 * margin
+    return points
+
+
+def synthetic_clip(exercise, reps, jitter, occlusion, seed=0):
+    # (timestamp, landmarks) frames with `reps` reps after a second of rest.
+    # Every coordinate gets Gaussian jitter; during occlusions the key
+    # landmarks have low visibility and arbitrary positions, like MediaPipe's
+    # guesses for hidden joints.
+    rng = np.random.default_rng(seed)
+    frames = []
+    occluded_until = -1.0
+    duration = 1.0 + reps * SYNTHETIC_PERIOD + 1.0
+    for i in range(int(duration * SYNTHETIC_FPS)):
+        t = i / SYNTHETIC_FPS
+        phase = min(max(t - 1.0, 0.0), reps * SYNTHETIC_PERIOD)
+        margin = -SYNTHETIC_AMPLITUDE * math.cos(2 * math.pi * phase / SYNTHETIC_PERIOD)
+        points = synthetic_pose(exercise, margin) + rng.normal(0, jitter, (NUM_LANDMARKS, 2))
+        visibility = np.full(NUM_LANDMARKS, 0.9)
+        if t > occluded_until and rng.random() < occlusion:
+            occluded_until = t + rng.uniform(0.1, 0.4)
+        if t <= occluded_until:
+            key = list(SYNTHETIC_KEY_LANDMARKS[exercise])
+            points[key] = rng.uniform(0.3, 0.7, (len(key), 2))
+            visibility[key] = rng.uniform(0.05, 0.4, len(key))
+        frames.append((t, [Landmark(x, y, v) for (x, y), v in zip(points.tolist(), visibility.tolist())]))
+    return frames
+
+
+def count(exercise, frames, stride, filtered):
+    counter = (make_counter if filtered else make_unfiltered_counter)(exercise, '')
+    for timestamp, landmarks in frames[::stride]:
+        counter.update(timestamp, landmarks)
+    return counter.reps
+
+
+def clip_landmarks(engine, exercise, video_path, tier):
+    run = engine.run(exercise, video_path, tier=tier)
+    try:
+        return [(timestamp, None if landmarks is None else
+                 [Landmark(l.x, l.y, l.visibility) for l in landmarks]) for timestamp, landmarks in run]
+    finally:
+        run.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rep counting accuracy with and without landmark filtering")
+    parser.add_argument('clips', nargs='*', help="PATH:EXERCISE pairs (default: the labeled clips in reference_clips/)")
+    parser.add_argument('--labels', default='reference_reps.json', help="JSON file of hand-counted reps per clip")
+    parser.add_argument('--strides', nargs='+', type=int, default=[1, 2, 3, 5],
+                        help="count every Nth frame, to simulate sparse sampling")
+    parser.add_argument('--jitter', nargs='+', type=float, default=[0.005, 0.015, 0.03],
+                        help="landmark noise for the synthetic streams, in normalized units")
+    parser.add_argument('--occlusion', type=float, default=0.02, help="chance per frame of an occlusion starting")
+    parser.add_argument('--reps', type=int, default=8, help="reps per synthetic stream")
+    parser.add_argument('--max-width', type=int, default=640, help="decode width, as in the app")
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+
+    with open(args.labels) as f:
+        labels = json.load(f)
+    if args.clips:
+        clips = dict(clip.rsplit(':', 1) for clip in args.clips)
+    else:
+        clips = {path: exercise for path, exercise in REFERENCE_CLIPS.items() if path in labels}
+
+    cases = []  # (source, exercise, tier or condition, frames, expected reps)
+    engine = PoseEngine(max_width=args.max_width)
+    for video_path, exercise in clips.items():
+        for tier in engine.available_tiers():
+            try:
+                cases.append((video_path, exercise, tier, clip_landmarks(engine, exercise, video_path, tier),
+                              labels[video_path]))
+            except MODEL_LOAD_ERRORS as e:
+                engine.mark_unavailable(tier, e)
+    for exercise in REP_EXERCISES:
+        for jitter in args.jitter:
+            frames = synthetic_clip(exercise, args.reps, jitter, args.occlusion)
+            cases.append(('synthetic', exercise, f"jitter {jitter}", frames, args.reps))
+
+    results = []
+    print(f"{'source':<36} {'exercise':<8} {'condition':<13} {'stride':>6} {'expected':>8} {'unfiltered':>10} "
+          f"{'filtered':>8}")
+    for source, exercise, condition, frames, expected in cases:
+        for stride in args.strides:
+            unfiltered = count(exercise, frames, stride, filtered=False)
+            filtered = count(exercise, frames, stride, filtered=True)
+            print(f"{source:<36} {exercise:<8} {condition:<13} {stride:>6} {expected:>8} {unfiltered:>10} "
+                  f"{filtered:>8}")
+            results.append({'source': source, 'exercise': exercise, 'condition': condition, 'stride': stride,
+                            'expected': expected, 'unfiltered': unfiltered, 'filtered': filtered})
+
+    print(f"\n{'stride':>6} {'unfiltered MAE':>14} {'filtered MAE':>12} {'unfiltered exact':>16} {'filtered exact':>14}")
+    for stride in args.strides:
+        rows = [r for r in results if r['stride'] == stride]
+        errors = {key: [abs(r[key] - r['expected']) for r in rows] for key in ('unfiltered', 'filtered')}
+        print(f"{stride:>6} {np.mean(errors['unfiltered']):>14.2f} {np.mean(errors['filtered']):>12.2f} "
+              f"{sum(e == 0 for e in errors['unfiltered']):>10}/{len(rows):<5} "
+              f"{sum(e == 0 for e in errors['filtered']):>8}/{len(rows):<5}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
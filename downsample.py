@@ -0,0 +1,36 @@
+import numpy as np
+
+# Downsampling of chart series before they are sent to clients.
+#
+# lttb() implements Largest-Triangle-Three-Buckets (Steinarsson, 2013): the
+# first and last points are kept, the rest are split into equal buckets and
+# from each bucket the point forming the largest triangle with the previously
+# kept point and the average of the next bucket is kept. Peaks and dips
+# survive, unlike with plain averaging or striding.
+
+
+def lttb(xs, ys, threshold):
+    # Returns the indices of the points to keep, in order
+    n = len(xs)
+    if threshold < 3:
+        raise ValueError("LTTB needs at least 3 points")
+    if threshold >= n:
+        return list(range(n))
+    xs = np.asarray(xs, dtype=float)
+    ys = np.asarray(ys, dtype=float)
+
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int).tolist()  # Buckets between the first and last point
+    kept = [0]
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x = xs[edges[i + 1]:edges[i + 2]].mean()
+            next_y = ys[edges[i + 1]:edges[i + 2]].mean()
+        else:
+            next_x, next_y = xs[-1], ys[-1]
+        prev_x, prev_y = xs[kept[-1]], ys[kept[-1]]
+        # Twice the triangle areas, the factor does not change the argmax
+        areas = np.abs((prev_x - next_x) * (ys[start:end] - prev_y) - (prev_x - xs[start:end]) * (next_y - prev_y))
+        kept.append(start + int(np.argmax(areas)))
+    kept.append(n - 1)
+    return kept
@@ -0,0 +1,258 @@
+import multiprocessing
+import os
+import sys
+import time
+from collections import namedtuple
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+# Shared-memory transport for decoded frames and landmark arrays between the
+# ingest, decode and pose processes. Frames live in a ring of fixed-size slots
+# in one shared memory segment; only small FrameDescriptor tuples go over a
+# multiprocessing.Queue, so no frame is ever pickled or copied between
+# processes.
+#
+#   ring = FrameRing(slots=8, slot_bytes=640 * 480 * 3)   # in the parent
+#   # pass `ring` to workers as a Process argument or in Pool(initargs=...)
+#   desc = ring.put(frame)                                 # producer
+#   queue.put(desc)
+#   with ring.open(queue.get()) as frame:                  # consumer
+#       pose.process(frame)
+#
+# The ring shares a multiprocessing.Lock, which can only be handed to
+# processes when they are started: it cannot travel with a Pool task
+# (pool.apply(work, (ring, desc)) fails) or over a Queue.
+#
+# Each reference to a slot is recorded against the pid holding it. The
+# producer holds the references until consumers claim them in open(), for at
+# most claim_timeout seconds. reclaim() drops references held by processes
+# that no longer exist and unclaimed ones past that lease, so a worker that
+# crashes before or after taking a descriptor off the queue cannot pin slots
+# forever. The creating process owns the segment and unlinks it on close (or
+# the resource tracker does if it dies).
+
+FrameDescriptor = namedtuple('FrameDescriptor', ['slot', 'generation', 'owner', 'shape', 'dtype', 'timestamp'])
+
+FREE = 0
+READY = 1
+
+MAX_HOLDERS = 4
+# Per-slot header: state, generation, refcount, producer references not yet
+# claimed and the monotonic deadline (ns) for claiming them, then (pid, count)
+# pairs
+STATE, GENERATION, REFCOUNT, UNCLAIMED, LEASE, HOLDERS = 0, 1, 2, 3, 4, 5
+HEADER_FIELDS = HOLDERS + 2 * MAX_HOLDERS
+SLOT_ALIGN = 64
+CLAIM_TIMEOUT = 10.0  # Seconds consumers have to claim a frame
+
+
+class StaleFrameError(Exception):
+    # The slot was reclaimed and reused before the descriptor was opened
+    pass
+
+
+class RingFullError(Exception):
+    pass
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class FrameRing:
+    def __init__(self, slots=8, slot_bytes=640 * 480 * 3, name=None, lock=None, claim_timeout=CLAIM_TIMEOUT):
+        self.slots = slots
+        self.claim_timeout = claim_timeout
+        self.slot_bytes = -(-slot_bytes // SLOT_ALIGN) * SLOT_ALIGN
+        self.header_bytes = -(-slots * HEADER_FIELDS * 8 // SLOT_ALIGN) * SLOT_ALIGN
+        self.creator = name is None
+        self.lock = lock if lock is not None else multiprocessing.Lock()
+
+        if self.creator:
+            self.shm = shared_memory.SharedMemory(create=True, size=self.header_bytes + slots * self.slot_bytes)
+        else:
+            self.shm = self._attach(name)
+        self.name = self.shm.name
+        self.header = np.ndarray((slots, HEADER_FIELDS), dtype=np.int64, buffer=self.shm.buf)
+        if self.creator:
+            self.header[:] = 0
+
+    @staticmethod
+    def _attach(name):
+        # Only the creator may unlink the segment. Before 3.13 attaching also
+        # registers it with this process's resource tracker, which would
+        # unlink it when a worker exits.
+        if sys.version_info >= (3, 13):
+            return shared_memory.SharedMemory(name=name, track=False)
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+    def __getstate__(self):
+        return {'slots': self.slots, 'slot_bytes': self.slot_bytes, 'name': self.name, 'lock': self.lock,
+                'claim_timeout': self.claim_timeout}
+
+    def __setstate__(self, state):
+        self.__init__(state['slots'], state['slot_bytes'], name=state['name'], lock=state['lock'],
+                      claim_timeout=state['claim_timeout'])
+
+    def close(self):
+        self.header = None
+        self.shm.close()
+        if self.creator:
+            self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def _slot_array(self, slot, shape, dtype):
+        return np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=self.header_bytes + slot * self.slot_bytes)
+
+    def _add_ref(self, slot, pid, count):
+        row = self.header[slot]
+        for i in range(HOLDERS, HEADER_FIELDS, 2):
+            if row[i] == pid:
+                row[i + 1] += count
+                break
+        else:
+            for i in range(HOLDERS, HEADER_FIELDS, 2):
+                if row[i + 1] == 0:
+                    row[i] = pid
+                    row[i + 1] = count
+                    break
+            else:
+                return False
+        row[REFCOUNT] += count
+        return True
+
+    def _drop_ref(self, slot, pid):
+        row = self.header[slot]
+        for i in range(HOLDERS, HEADER_FIELDS, 2):
+            if row[i] == pid and row[i + 1] > 0:
+                row[i + 1] -= 1
+                row[REFCOUNT] -= 1
+                if row[REFCOUNT] == 0:
+                    row[STATE] = FREE
+                return True
+        return False
+
+    def reserve(self, shape, dtype=np.uint8, timestamp=0.0, refs=1, timeout=None):
+        # Claim a free slot and return (descriptor, writable view). The caller
+        # fills the view (e.g. as a cv2 dst= buffer) and then sends the
+        # descriptor to `refs` consumers.
+        dtype = np.dtype(dtype)
+        if int(np.prod(shape)) * dtype.itemsize > self.slot_bytes:
+            raise ValueError(f"Frame of shape {shape} does not fit in a {self.slot_bytes} byte slot")
+        pid = os.getpid()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.lock:
+                free = np.flatnonzero(self.header[:, STATE] == FREE)
+                if len(free) == 0:
+                    self._reclaim_locked()
+                    free = np.flatnonzero(self.header[:, STATE] == FREE)
+                if len(free):
+                    slot = int(free[0])
+                    row = self.header[slot]
+                    # Bumped on every reuse so stale descriptors can be detected
+                    generation = row[GENERATION] + 1
+                    row[:] = 0
+                    row[GENERATION] = generation
+                    row[STATE] = READY
+                    row[UNCLAIMED] = refs
+                    if self.claim_timeout is not None:
+                        row[LEASE] = time.monotonic_ns() + int(self.claim_timeout * 1e9)
+                    self._add_ref(slot, pid, refs)
+                    desc = FrameDescriptor(slot, int(row[GENERATION]), pid, tuple(shape), dtype.str, timestamp)
+                    return desc, self._slot_array(slot, shape, dtype)
+            if deadline is not None and time.monotonic() >= deadline:
+                raise RingFullError("No free frame slot")
+            # Backpressure: wait for consumers to release a slot
+            time.sleep(0.001)
+
+    def put(self, array, timestamp=0.0, refs=1, timeout=None):
+        desc, view = self.reserve(array.shape, array.dtype, timestamp, refs, timeout)
+        np.copyto(view, array)
+        return desc
+
+    def claim(self, desc):
+        # Move one reference from the producer to this process and return a
+        # read-only view of the frame
+        pid = os.getpid()
+        with self.lock:
+            row = self.header[desc.slot]
+            if row[STATE] != READY or row[GENERATION] != desc.generation or row[UNCLAIMED] <= 0:
+                raise StaleFrameError(f"Slot {desc.slot} was released or reused")
+            if pid != desc.owner:
+                # Take our reference before dropping the producer's, so the
+                # count never touches zero in between
+                if not self._add_ref(desc.slot, pid, 1):
+                    raise RingFullError(f"Too many processes hold slot {desc.slot}")
+                if not self._drop_ref(desc.slot, desc.owner):
+                    self._drop_ref(desc.slot, pid)
+                    raise StaleFrameError(f"Slot {desc.slot} has no reference left to claim")
+            row[UNCLAIMED] -= 1
+        view = self._slot_array(desc.slot, desc.shape, np.dtype(desc.dtype))
+        view.flags.writeable = False
+        return view
+
+    def release(self, desc):
+        with self.lock:
+            if self.header[desc.slot, GENERATION] == desc.generation:
+                self._drop_ref(desc.slot, os.getpid())
+
+    def open(self, desc):
+        return _OpenFrame(self, desc)
+
+    def reclaim(self):
+        with self.lock:
+            return self._reclaim_locked()
+
+    def _reclaim_locked(self):
+        # Drop references held by processes that have exited, and producer
+        # references nobody claimed within the lease
+        reclaimed = 0
+        now = time.monotonic_ns()
+        for slot in np.flatnonzero(self.header[:, STATE] == READY):
+            row = self.header[slot]
+            if row[UNCLAIMED] > 0 and row[LEASE] and now > row[LEASE]:
+                owner = int(row[HOLDERS])  # reserve() records the producer first
+                for _ in range(int(row[UNCLAIMED])):
+                    self._drop_ref(slot, owner)
+                row[UNCLAIMED] = 0
+            for i in range(HOLDERS, HEADER_FIELDS, 2):
+                if row[i + 1] > 0 and not pid_alive(int(row[i])):
+                    row[REFCOUNT] -= row[i + 1]
+                    row[i + 1] = 0
+            if row[REFCOUNT] <= 0:
+                row[STATE] = FREE
+                reclaimed += 1
+        return reclaimed
+
+    def in_use(self):
+        with self.lock:
+            return int(np.count_nonzero(self.header[:, STATE] == READY))
+
+
+class _OpenFrame:
+    def __init__(self, ring, desc):
+        self.ring = ring
+        self.desc = desc
+
+    def __enter__(self):
+        return self.ring.claim(self.desc)
+
+    def __exit__(self, exc_type, exc, tb):
+        self.ring.release(self.desc)
+        return False
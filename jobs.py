@@ -0,0 +1,203 @@
+import re
+import secrets
+import threading
+import time
+
+# Progress tracking and cooperative cancellation for video analyses.
+#
+# The capture pages pick a job id, send it with the upload and follow
+# /analysis/<job_id>/events while the upload request runs. The analysis loop
+# calls job.advance() once per frame, which publishes progress and raises
+# JobCancelled as soon as /analysis/<job_id>/cancel has been called.
+#
+# Jobs may carry an upload key (see app.upload_key_for). A retried upload
+# whose key is still being analyzed attaches to the running job instead of
+# starting a second analysis, and its job id becomes an alias of that job.
+
+JOB_ID_PATTERN = re.compile(r'^[A-Za-z0-9-]{8,64}$')
+FINISHED_JOB_TTL = 300  # Seconds a finished job stays visible to late listeners
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class AnalysisJob:
+    def __init__(self, job_id, user_id, exercise, upload_key=None):
+        self.id = job_id
+        self.user_id = user_id
+        self.exercise = exercise
+        self.upload_key = upload_key
+        self.state = QUEUED
+        self.total_frames = None
+        self.frames = 0
+        self.reps = 0
+        self.started = None
+        self.finished = None
+        self.version = 0
+        self.cond = threading.Condition()
+        self.cancel_requested = threading.Event()
+
+    def start(self, total_frames):
+        with self.cond:
+            self.state = RUNNING
+            self.total_frames = total_frames
+            self.started = time.monotonic()
+            self._changed()
+        self.check_cancelled()
+
+    def advance(self, reps):
+        with self.cond:
+            self.frames += 1
+            self.reps = reps
+            self._changed()
+        self.check_cancelled()
+
+    def check_cancelled(self):
+        if self.cancel_requested.is_set():
+            raise JobCancelled(f"Analysis {self.id} was cancelled")
+
+    def cancel(self):
+        self.cancel_requested.set()
+        with self.cond:
+            self._changed()
+
+    def finish(self, state):
+        with self.cond:
+            self.state = state
+            self.finished = time.monotonic()
+            self._changed()
+
+    def _changed(self):
+        self.version += 1
+        self.cond.notify_all()
+
+    @property
+    def is_finished(self):
+        return self.state in (DONE, FAILED, CANCELLED)
+
+    def status(self):
+        eta = None
+        if self.state == RUNNING and self.total_frames and self.frames:
+            elapsed = time.monotonic() - self.started
+            eta = max(self.total_frames - self.frames, 0) * elapsed / self.frames
+        return {
+            'id': self.id,
+            'exercise': self.exercise,
+            'state': self.state,
+            'frames': self.frames,
+            'totalFrames': self.total_frames,
+            'reps': self.reps,
+            'eta': eta,
+        }
+
+    def wait_for_change(self, version, timeout):
+        with self.cond:
+            self.cond.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    def wait_finished(self, timeout=None):
+        with self.cond:
+            return self.cond.wait_for(lambda: self.is_finished, timeout)
+
+
+class JobRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.in_flight = {}  # (user_id, upload_key) -> running job
+
+    def create(self, job_id, user_id, exercise, upload_key=None):
+        with self.lock:
+            job = AnalysisJob(self._free_id_locked(job_id), user_id, exercise, upload_key)
+            self.jobs[job.id] = job
+        return job
+
+    def get(self, job_id, user_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None or job.user_id != user_id:
+            return None
+        return job
+
+    def running(self, user_id, upload_key):
+        with self.lock:
+            return self.in_flight.get((user_id, upload_key))
+
+    def alias(self, job_id, job):
+        # Lets a retried upload follow the running job under its own job id
+        with self.lock:
+            self._alias_locked(job_id, job)
+
+    def track(self, job_id, user_id, exercise, upload_key=None):
+        # Start tracking a new job, or attach to the running job with the
+        # same upload key
+        if upload_key is not None:
+            with self.lock:
+                running = self.in_flight.get((user_id, upload_key))
+                if running is not None:
+                    self._alias_locked(job_id, running)
+                    return _TrackedJob(self, running, attached=True)
+                job = AnalysisJob(self._free_id_locked(job_id), user_id, exercise, upload_key)
+                self.jobs[job.id] = job
+                self.in_flight[(user_id, upload_key)] = job
+            return _TrackedJob(self, job)
+        return _TrackedJob(self, self.create(job_id, user_id, exercise))
+
+    def _finished(self, job):
+        with self.lock:
+            key = (job.user_id, job.upload_key)
+            if self.in_flight.get(key) is job:
+                del self.in_flight[key]
+
+    def _free_id_locked(self, job_id):
+        # The client's job id, unless it is malformed or already names another
+        # job: replacing that job would cut its owner off from its progress
+        # stream and cancellation
+        self._expire()
+        if not job_id or not JOB_ID_PATTERN.match(job_id) or job_id in self.jobs:
+            return secrets.token_hex(16)
+        return job_id
+
+    def _alias_locked(self, job_id, job):
+        # An alias nobody asked for is of no use, so a taken or malformed id
+        # is skipped instead of replaced
+        if self._free_id_locked(job_id) == job_id:
+            self.jobs[job_id] = job
+
+    def _expire(self):
+        now = time.monotonic()
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job.finished is not None and now - job.finished > FINISHED_JOB_TTL]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+
+class _TrackedJob:
+    # Marks the job done, failed or cancelled when the analysis block exits.
+    # An attached tracker leaves the job to the request that started it.
+    def __init__(self, registry, job, attached=False):
+        self.registry = registry
+        self.job = job
+        self.attached = attached
+
+    def __enter__(self):
+        return self.job
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.attached:
+            return False
+        if exc_type is None:
+            self.job.finish(DONE)
+        elif issubclass(exc_type, JobCancelled):
+            self.job.finish(CANCELLED)
+        else:
+            self.job.finish(FAILED)
+        self.registry._finished(self.job)
+        return False
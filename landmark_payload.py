@@ -0,0 +1,127 @@
+import struct
+
+import numpy as np
+
+from rep_counting import Landmark, NUM_LANDMARKS, LEFT_SHOULDER, RIGHT_SHOULDER, LEFT_HIP, RIGHT_HIP
+
+# Compact binary landmark upload, produced in the browser by MediaPipe's JS
+# pose build instead of uploading the video itself. All fields little-endian.
+#
+#   header   magic "FTLM", version u8, landmark count u8, flags u16, frame count u32
+#   frame    timestamp in ms since recording start u32, pose detected u8,
+#            then per landmark: x i16, y i16, visibility u8
+#
+# x and y are MediaPipe's normalized image coordinates times COORD_SCALE,
+# visibility is scaled to 0..255. A frame is 170 bytes, so a minute at
+# 30 fps is about 300 KB, against several MB of video.
+
+MAGIC = b'FTLM'
+VERSION = 1
+COORD_SCALE = 10000.0
+HEADER = struct.Struct('<4sBBHI')
+
+FRAME_DTYPE = np.dtype([
+    ('timestamp_ms', '<u4'),
+    ('detected', 'u1'),
+    ('landmarks', [('x', '<i2'), ('y', '<i2'), ('visibility', 'u1')], (NUM_LANDMARKS,)),
+])
+
+# Plausibility limits
+MAX_DURATION = 30 * 60  # seconds
+MAX_FPS = 120
+MAX_FRAMES = MAX_DURATION * MAX_FPS
+MAX_COORD = 2.0  # MediaPipe reports points slightly outside the frame, not far outside
+MIN_TORSO = 0.01  # Shoulder-to-hip distance below which a detected pose is degenerate
+
+
+class PayloadError(ValueError):
+    pass
+
+
+class LandmarkFrame:
+    # One decoded frame, indexable like MediaPipe's landmark list. Landmarks
+    # are only materialized when the counters look them up.
+    __slots__ = ('row',)
+
+    def __init__(self, row):
+        self.row = row
+
+    def __getitem__(self, index):
+        x, y, visibility = self.row[index]
+        return Landmark(x / COORD_SCALE, y / COORD_SCALE, visibility / 255.0)
+
+    def __len__(self):
+        return NUM_LANDMARKS
+
+    def array(self):
+        # All landmarks as a (NUM_LANDMARKS, 3) float array of x, y, visibility
+        return np.array(self.row, dtype=float) / (COORD_SCALE, COORD_SCALE, 255.0)
+
+
+def encode_payload(frames):
+    # frames: iterable of (timestamp_in_seconds, landmarks or None), where
+    # landmarks has .x, .y and .visibility per item (e.g. MediaPipe results)
+    frames = list(frames)
+    data = np.zeros(len(frames), dtype=FRAME_DTYPE)
+    for i, (timestamp, landmarks) in enumerate(frames):
+        data['timestamp_ms'][i] = int(round(timestamp * 1000))
+        if landmarks is None:
+            continue
+        data['detected'][i] = 1
+        for j in range(NUM_LANDMARKS):
+            landmark = landmarks[j]
+            data['landmarks'][i, j] = (
+                int(round(np.clip(landmark.x, -MAX_COORD, MAX_COORD) * COORD_SCALE)),
+                int(round(np.clip(landmark.y, -MAX_COORD, MAX_COORD) * COORD_SCALE)),
+                int(round(np.clip(landmark.visibility, 0.0, 1.0) * 255)),
+            )
+    return HEADER.pack(MAGIC, VERSION, NUM_LANDMARKS, 0, len(frames)) + data.tobytes()
+
+
+def decode_payload(payload):
+    # Validate a payload and return its frames as (timestamp, landmarks or None)
+    if len(payload) < HEADER.size:
+        raise PayloadError("Payload is too short")
+    magic, version, landmark_count, flags, frame_count = HEADER.unpack_from(payload)
+    if magic != MAGIC:
+        raise PayloadError("Not a landmark payload")
+    if version != VERSION:
+        raise PayloadError(f"Unsupported payload version {version}")
+    if landmark_count != NUM_LANDMARKS:
+        raise PayloadError(f"Expected {NUM_LANDMARKS} landmarks per frame, got {landmark_count}")
+    if not 0 < frame_count <= MAX_FRAMES:
+        raise PayloadError(f"Frame count {frame_count} is out of range")
+    if len(payload) != HEADER.size + frame_count * FRAME_DTYPE.itemsize:
+        raise PayloadError("Payload size does not match its frame count")
+
+    data = np.frombuffer(payload, dtype=FRAME_DTYPE, count=frame_count, offset=HEADER.size)
+
+    timestamps = data['timestamp_ms'].astype(np.int64)
+    if frame_count > 1:
+        if np.any(np.diff(timestamps) <= 0):
+            raise PayloadError("Timestamps must be strictly increasing")
+        elapsed = (timestamps[-1] - timestamps[0]) / 1000.0
+        if elapsed > MAX_DURATION:
+            raise PayloadError("Recording is too long")
+        if (frame_count - 1) / elapsed > MAX_FPS:
+            raise PayloadError("Frame rate is implausibly high")
+
+    detected = data['detected'] != 0
+    landmarks = data['landmarks']
+    if np.any(data['detected'] > 1):
+        raise PayloadError("Invalid pose detected flag")
+    coords = np.stack([landmarks['x'][detected], landmarks['y'][detected]]).astype(np.float32) / COORD_SCALE
+    if np.any(np.abs(coords) > MAX_COORD):
+        raise PayloadError("Landmark coordinates are out of range")
+    if np.any(detected):
+        # Shoulders and hips collapsed onto each other is not a body
+        shoulders = (coords[:, :, LEFT_SHOULDER] + coords[:, :, RIGHT_SHOULDER]) / 2
+        hips = (coords[:, :, LEFT_HIP] + coords[:, :, RIGHT_HIP]) / 2
+        torso = np.hypot(*(shoulders - hips))
+        if np.median(torso) < MIN_TORSO:
+            raise PayloadError("Landmarks do not describe a plausible pose")
+
+    frames = []
+    for timestamp, is_detected, row in zip(timestamps.tolist(), detected.tolist(), landmarks.tolist()):
+        frames.append((timestamp / 1000.0, LandmarkFrame(row) if is_detected else None))
+    return frames
@@ -0,0 +1,385 @@
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+
+import cv2
+import numpy as np
+
+from rep_counting import EXERCISES
+from video_decode import av
+
+# Load test for the Flask app. Virtual users sign up, log in and then run a
+# weighted mix of requests against a server until the test duration is up:
+#
+#   python loadtest.py --spawn --users 8 --duration 60
+#   python loadtest.py --url http://127.0.0.1:5000 --mix dashboard=8,upload=1 \
+#       --video reference_clips/squats.mkv
+#
+# Request types for --mix:
+#   dashboard  GET /dashboard
+#   login      POST /login again with the user's credentials
+#   upload     POST a new recording to /capture_video/<exercise>
+#   retry      POST the user's last recording again with the same Idempotency-Key
+#
+# --spawn starts the app in a scratch directory with its own database, so the
+# load never touches instance/fitness_tracker.db or captured_videos/. The report has p50/p95/p99 latency, throughput
+# and error rates per request type, and the server's resident memory over time
+# (Linux only, and only when the server was spawned or --pid is given).
+# 429/503 answers from admission control are counted as rejected, not errors.
+
+DEFAULT_MIX = 'dashboard=10,login=1,upload=2,retry=1'
+READY_TIMEOUT = 60  # Seconds to wait for a spawned server to answer
+REQUEST_TIMEOUT = 300
+
+
+def make_fixture(path, seconds=10, width=640, height=480, fps=15):
+    # Synthetic recording of a figure squatting up and down, in the WebM/VP8
+    # format most browsers record (or MPEG-4 when PyAV is not installed). It
+    # costs the server the same decode and inference work as a real upload of
+    # that size, though the pose model will not always find the figure.
+    frames = int(seconds * fps)
+    if av is not None:
+        container = av.open(path, mode='w', format='webm')
+        stream = container.add_stream('libvpx', rate=fps)
+        stream.width = width
+        stream.height = height
+        stream.pix_fmt = 'yuv420p'
+        stream.bit_rate = int(width * height * fps * 0.1)
+        for i in range(frames):
+            frame = av.VideoFrame.from_ndarray(draw_figure(i / fps, width, height), format='rgb24')
+            for packet in stream.encode(frame):
+                container.mux(packet)
+        for packet in stream.encode():
+            container.mux(packet)
+        container.close()
+    else:
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+        for i in range(frames):
+            writer.write(cv2.cvtColor(draw_figure(i / fps, width, height), cv2.COLOR_RGB2BGR))
+        writer.release()
+    return path
+
+
+def draw_figure(t, width, height):
+    image = np.full((height, width, 3), 200, dtype=np.uint8)
+    depth = (1 - np.cos(t * np.pi)) / 2  # One squat every two seconds
+    cx = width // 2
+    unit = height / 10
+    head = (cx, int(unit * (1.5 + 2 * depth)))
+    shoulder = (cx, int(unit * (2.5 + 2 * depth)))
+    hip = (cx, int(unit * (5 + 2 * depth)))
+    knee = (int(cx + unit * 1.5 * depth), int(unit * (7 + depth)))
+    ankle = (cx, int(unit * 9))
+    color = (60, 60, 60)
+    thickness = max(2, int(unit / 3))
+    cv2.circle(image, head, int(unit * 0.7), color, -1)
+    for a, b in [(shoulder, hip), (hip, knee), (knee, ankle)]:
+        cv2.line(image, a, b, color, thickness)
+    for side in (-1, 1):
+        cv2.line(image, shoulder, (int(cx + side * unit * 1.5), int(shoulder[1] + unit * 1.5)), color, thickness)
+    return image
+
+
+def encode_multipart(fields, files):
+    # files: {name: (filename, content_type, bytes)}
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content_type, data) in files.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: {content_type}\r\n\r\n'.encode())
+        parts.append(data)
+        parts.append(b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else None
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = []  # (request type, finished at, seconds, status or None)
+
+    def record(self, name, finished, elapsed, status):
+        with self.lock:
+            self.samples.append((name, finished, elapsed, status))
+
+    def completed(self):
+        with self.lock:
+            return len(self.samples)
+
+    def summary(self, elapsed):
+        with self.lock:
+            samples = list(self.samples)
+        names = sorted({s[0] for s in samples})
+        rows = {}
+        for name in names + ['total']:
+            selected = [s for s in samples if name == 'total' or s[0] == name]
+            ok = [s[2] for s in selected if s[3] is not None and s[3] < 400]
+            rejected = sum(1 for s in selected if s[3] in (429, 503))
+            errors = len(selected) - len(ok) - rejected
+            rows[name] = {
+                'requests': len(selected),
+                'ok': len(ok),
+                'rejected': rejected,
+                'errors': errors,
+                'errorRate': errors / len(selected) if selected else 0.0,
+                'throughput': len(ok) / elapsed if elapsed else 0.0,
+                'p50': percentile(ok, 50),
+                'p95': percentile(ok, 95),
+                'p99': percentile(ok, 99),
+            }
+        return rows
+
+
+class VirtualUser:
+    def __init__(self, base_url, stats, video, exercises):
+        self.base_url = base_url
+        self.stats = stats
+        self.video = video
+        self.exercises = exercises
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        name = 'load-' + uuid.uuid4().hex[:12]
+        self.credentials = {'username': name, 'password': 'load-test', 'email': name + '@example.com',
+                            'age': str(random.randint(18, 70)), 'gender': random.choice(['male', 'female'])}
+        self.last_upload = None
+
+    def request(self, name, path, data=None, headers=None):
+        request = urllib.request.Request(self.base_url + path, data=data, headers=headers or {})
+        start = time.perf_counter()
+        status = None
+        try:
+            with self.opener.open(request, timeout=REQUEST_TIMEOUT) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            status = e.code
+        except (urllib.error.URLError, OSError):
+            pass
+        self.stats.record(name, time.monotonic(), time.perf_counter() - start, status)
+        return status
+
+    def post_form(self, name, path, fields):
+        data = urllib.parse.urlencode(fields).encode()
+        return self.request(name, path, data, {'Content-Type': 'application/x-www-form-urlencoded'})
+
+    def signup(self):
+        return self.post_form('signup', '/signup', self.credentials)
+
+    def login(self):
+        fields = {'username': self.credentials['username'], 'password': self.credentials['password']}
+        return self.post_form('login', '/login', fields)
+
+    def dashboard(self):
+        return self.request('dashboard', '/dashboard')
+
+    def upload(self):
+        self.last_upload = (random.choice(self.exercises), str(uuid.uuid4()))
+        return self.retry('upload')
+
+    def retry(self, name='retry'):
+        if self.last_upload is None:
+            return self.upload()
+        exercise, key = self.last_upload
+        filename, content_type, data = self.video
+        body, content_type_header = encode_multipart(
+            {'notes': 'load test', 'weight': '20', 'job_id': str(uuid.uuid4())},
+            {'video': (filename, content_type, data)})
+        headers = {'Content-Type': content_type_header, 'Idempotency-Key': key}
+        return self.request(name, f'/capture_video/{exercise}', body, headers)
+
+    def run(self, mix, deadline, think):
+        self.signup()
+        self.login()
+        actions = [getattr(self, action) for action in mix]
+        weights = list(mix.values())
+        while time.monotonic() < deadline:
+            random.choices(actions, weights)[0]()
+            if think:
+                time.sleep(random.uniform(0, 2 * think))
+
+
+def read_rss(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def sample_server(pid, stats, interval, stop, timeline):
+    start = time.monotonic()
+    while True:
+        rss = read_rss(pid) if pid else None
+        timeline.append({'t': time.monotonic() - start, 'rssMB': rss / 2 ** 20 if rss else None,
+                         'completed': stats.completed()})
+        if stop.wait(interval):
+            break
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(','):
+        action, _, weight = item.partition('=')
+        action = action.strip()
+        if action not in ('dashboard', 'login', 'upload', 'retry'):
+            raise argparse.ArgumentTypeError(f"Unknown request type in mix: {action}")
+        mix[action] = float(weight or 1)
+    return mix
+
+
+def serve(port):
+    # Runs in the spawned server process
+    from app import app, db, upgrade_schema
+    with app.app_context():
+        db.create_all()
+        upgrade_schema()
+    app.run(host='127.0.0.1', port=port, threaded=True, use_reloader=False)
+
+
+def spawn_server(port, workdir, admission_config):
+    env = dict(os.environ, DATABASE_URI='sqlite:///' + os.path.join(workdir, 'loadtest.db'))
+    if admission_config:
+        env['ADMISSION_CONFIG'] = os.path.abspath(admission_config)
+    # Run from the scratch directory so uploads are saved there, not in captured_videos/
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', str(port)], env=env,
+                              cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + READY_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f"Server exited with status {server.returncode}")
+        try:
+            with urllib.request.urlopen(base_url + '/', timeout=1):
+                return server, base_url
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.2)
+    server.terminate()
+    raise SystemExit("Server did not start in time")
+
+
+def print_report(rows, elapsed, timeline):
+    def ms(value):
+        return f"{value * 1000:.0f}" if value is not None else '-'
+
+    print(f"\n{elapsed:.1f} s")
+    print(f"{'request':<10} {'count':>7} {'ok':>7} {'rejected':>8} {'errors':>7} {'err %':>6} "
+          f"{'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, row in rows.items():
+        print(f"{name:<10} {row['requests']:>7} {row['ok']:>7} {row['rejected']:>8} {row['errors']:>7} "
+              f"{row['errorRate'] * 100:>6.1f} {row['throughput']:>7.2f} "
+              f"{ms(row['p50']):>8} {ms(row['p95']):>8} {ms(row['p99']):>8}")
+
+    print(f"\n{'t (s)':>7} {'rss MB':>8} {'req/s':>7}")
+    previous = None
+    for point in timeline:
+        rate = ''
+        if previous is not None and point['t'] > previous['t']:
+            rate = f"{(point['completed'] - previous['completed']) / (point['t'] - previous['t']):.1f}"
+        rss = f"{point['rssMB']:.0f}" if point['rssMB'] is not None else '-'
+        print(f"{point['t']:>7.1f} {rss:>8} {rate:>7}")
+        previous = point
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test signup, login, dashboard and video uploads")
+    parser.add_argument('--url', help="server to test, e.g. http://127.0.0.1:5000")
+    parser.add_argument('--spawn', action='store_true', help="start the app on a scratch database and test it")
+    parser.add_argument('--port', type=int, default=5055, help="port for --spawn")
+    parser.add_argument('--pid', type=int, help="server pid to sample memory from when not spawned")
+    parser.add_argument('--admission-config', help="admission config file for the spawned server")
+    parser.add_argument('--users', type=int, default=4, help="concurrent virtual users")
+    parser.add_argument('--duration', type=float, default=30, help="seconds to run")
+    parser.add_argument('--ramp', type=float, default=0, help="seconds over which users are started")
+    parser.add_argument('--think', type=float, default=0.5, help="mean seconds between a user's requests")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"weighted request mix (default: {DEFAULT_MIX})")
+    parser.add_argument('--exercises', nargs='+', default=list(EXERCISES), choices=EXERCISES)
+    parser.add_argument('--video', help="clip to upload (default: a synthetic recording)")
+    parser.add_argument('--fixture-seconds', type=float, default=10)
+    parser.add_argument('--fixture-size', default='640x480', help="WIDTHxHEIGHT of the synthetic recording")
+    parser.add_argument('--sample-interval', type=float, default=1.0, help="seconds between memory samples")
+    parser.add_argument('--json', help="also write the results to this file")
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve)
+        return
+    if not args.url and not args.spawn:
+        parser.error("give --url or --spawn")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.video:
+            with open(args.video, 'rb') as f:
+                video = (os.path.basename(args.video), 'application/octet-stream', f.read())
+        else:
+            width, height = (int(v) for v in args.fixture_size.split('x'))
+            path = make_fixture(os.path.join(workdir, 'fixture.webm' if av is not None else 'fixture.mp4'),
+                                args.fixture_seconds, width, height)
+            with open(path, 'rb') as f:
+                video = (os.path.basename(path), 'video/webm' if av is not None else 'video/mp4', f.read())
+        print(f"Uploading {video[0]}, {len(video[2]) / 1024:.0f} KB")
+
+        server = None
+        base_url, pid = args.url, args.pid
+        if args.spawn:
+            server, base_url = spawn_server(args.port, workdir, args.admission_config)
+            pid = server.pid
+
+        stats = Stats()
+        timeline = []
+        stop = threading.Event()
+        sampler = threading.Thread(target=sample_server, args=(pid, stats, args.sample_interval, stop, timeline),
+                                   daemon=True)
+        try:
+            start = time.monotonic()
+            deadline = start + args.duration
+            sampler.start()
+            users = []
+            for i in range(args.users):
+                user = VirtualUser(base_url, stats, video, args.exercises)
+                thread = threading.Thread(target=user.run, args=(args.mix, deadline, args.think), daemon=True)
+                thread.start()
+                users.append(thread)
+                if args.ramp and i < args.users - 1:
+                    time.sleep(args.ramp / (args.users - 1))
+            for thread in users:
+                thread.join()
+            elapsed = time.monotonic() - start
+        finally:
+            stop.set()
+            sampler.join()
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    rows = stats.summary(elapsed)
+    print_report(rows, elapsed, timeline)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'users': args.users, 'duration': elapsed, 'mix': args.mix, 'requests': rows,
+                       'server': timeline}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import urllib.request
+
+import mediapipe as mp
+
+from rep_counting import (LEFT_ELBOW, LEFT_HIP, LEFT_KNEE, LEFT_SHOULDER, LEFT_WRIST, RIGHT_ELBOW, RIGHT_HIP,
+                          RIGHT_KNEE, RIGHT_SHOULDER)
+from video_decode import probe_video, read_frames
+
+# Pose estimation for the video analyzers, with a choice of MediaPipe Pose
+# model tiers per job:
+#
+#   run = pose_engine.run('squats', video_path, budget=60, frame_count=info.frame_count)
+#   for timestamp, landmarks in run:
+#       counter.update(timestamp, landmarks)
+#
+# plan() picks the cheapest tier that meets the exercise's accuracy target
+# (ACCURACY_PROFILES) and still fits the job's latency budget, from per-frame
+# costs measured on earlier jobs. While a job runs, frames where the landmarks
+# the exercise is counted from are poorly visible are re-run on the next
+# heavier tier, for ESCALATION_FRAMES frames at a time, as long as the budget
+# has room for it.
+#
+# MediaPipe only bundles the full model. Jobs never download models: lite and
+# heavy are only used once fetched ahead of time with
+#
+#   python pose_engine.py fetch lite heavy
+#
+# Tiers that are not installed or cannot be loaded are skipped.
+
+logger = logging.getLogger(__name__)
+
+mp_pose = mp.solutions.pose
+
+MODEL_TIERS = ('lite', 'full', 'heavy')  # Cheapest first
+MODEL_COMPLEXITY = {'lite': 0, 'full': 1, 'heavy': 2}
+
+# Starting estimates of seconds per frame until jobs have been measured
+INITIAL_SECONDS_PER_FRAME = {'lite': 0.02, 'full': 0.03, 'heavy': 0.09}
+SMOOTHING = 0.02  # Per-frame EWMA weight
+ESCALATION_FRAMES = 15  # Frames run on the heavier tier after a low-visibility frame
+MODEL_LOAD_ERRORS = (OSError, RuntimeError)  # Missing or broken model, failed graph setup
+
+MODEL_DIR = os.path.join(os.path.dirname(mp.__file__), 'modules', 'pose_landmark')
+MODEL_FILES = {tier: f'pose_landmark_{tier}.tflite' for tier in MODEL_TIERS}
+MODEL_URL = 'https://storage.googleapis.com/mediapipe-assets/'  # Where MediaPipe downloads them from
+
+# min_tier is the cheapest tier that tracks the exercise reliably. The visibility
+# of key_landmarks decides when a frame is escalated to a heavier tier. Lite has
+# not been measured against full with bench_pose.py yet, so no exercise starts
+# on it; it is only used when full does not fit the latency budget.
+ACCURACY_PROFILES = {
+    'pushups': {
+        'min_tier': 'full',
+        'min_detection_confidence': 0.5,
+        'min_tracking_confidence': 0.5,
+        'key_landmarks': (LEFT_SHOULDER, RIGHT_SHOULDER, LEFT_ELBOW, RIGHT_ELBOW),
+        'min_visibility': 0.5,
+    },
+    'squats': {
+        'min_tier': 'full',
+        'min_detection_confidence': 0.5,
+        'min_tracking_confidence': 0.5,
+        'key_landmarks': (LEFT_HIP, LEFT_KNEE),
+        'min_visibility': 0.5,
+    },
+    'planks': {
+        # The plank counter itself reads elbow visibility, so escalate before
+        # it would flip to "Side plank"
+        'min_tier': 'full',
+        'min_detection_confidence': 0.5,
+        'min_tracking_confidence': 0.5,
+        'key_landmarks': (LEFT_ELBOW, RIGHT_ELBOW, LEFT_HIP, RIGHT_HIP),
+        'min_visibility': 0.6,
+    },
+    'lunges': {
+        # The trailing knee is often hidden behind the front leg
+        'min_tier': 'full',
+        'min_detection_confidence': 0.5,
+        'min_tracking_confidence': 0.6,
+        'key_landmarks': (LEFT_HIP, LEFT_KNEE, RIGHT_HIP, RIGHT_KNEE),
+        'min_visibility': 0.5,
+    },
+    'pullups': {
+        # Wrists overhead and against the bar are the hardest joints to track
+        'min_tier': 'full',
+        'min_detection_confidence': 0.5,
+        'min_tracking_confidence': 0.5,
+        'key_landmarks': (LEFT_WRIST, LEFT_ELBOW, LEFT_SHOULDER),
+        'min_visibility': 0.5,
+    },
+}
+
+
+def model_installed(tier):
+    return os.path.exists(os.path.join(MODEL_DIR, MODEL_FILES[tier]))
+
+
+def fetch_model(tier):
+    # Download a model tier into MediaPipe's model directory, through a
+    # temporary file so an interrupted download never leaves a partial model
+    path = os.path.join(MODEL_DIR, MODEL_FILES[tier])
+    if os.path.exists(path):
+        return path
+    fd, tmp_path = tempfile.mkstemp(dir=MODEL_DIR, suffix='.part')
+    try:
+        with urllib.request.urlopen(MODEL_URL + MODEL_FILES[tier], timeout=60) as response, \
+                os.fdopen(fd, 'wb') as f:
+            shutil.copyfileobj(response, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return path
+
+
+def key_visibility(landmarks, key_landmarks):
+    # Lowest visibility among the landmarks an exercise is counted from
+    if landmarks is None:
+        return 0.0
+    return min(landmarks[i].visibility for i in key_landmarks)
+
+
+class PoseEngine:
+    def __init__(self, max_width=None):
+        self.max_width = max_width
+        self.lock = threading.Lock()
+        self.seconds_per_frame = dict(INITIAL_SECONDS_PER_FRAME)
+        self.unavailable = set()
+
+    def open(self, tier, exercise):
+        profile = ACCURACY_PROFILES[exercise]
+        return mp_pose.Pose(model_complexity=MODEL_COMPLEXITY[tier],
+                            min_detection_confidence=profile['min_detection_confidence'],
+                            min_tracking_confidence=profile['min_tracking_confidence'])
+
+    def installed(self, tier):
+        return model_installed(tier)
+
+    def available_tiers(self):
+        with self.lock:
+            unavailable = set(self.unavailable)
+        return [tier for tier in MODEL_TIERS if tier not in unavailable and self.installed(tier)]
+
+    def mark_unavailable(self, tier, error):
+        logger.warning("Pose model tier %s is unavailable: %s", tier, error)
+        with self.lock:
+            self.unavailable.add(tier)
+
+    def measured(self, tier, seconds):
+        with self.lock:
+            self.seconds_per_frame[tier] += SMOOTHING * (seconds - self.seconds_per_frame[tier])
+
+    def cost(self, tier, frames):
+        with self.lock:
+            return frames * self.seconds_per_frame[tier]
+
+    def plan(self, exercise, frame_count, budget):
+        # Cheapest tier meeting the accuracy target within budget. If the
+        # target tier is over budget, the most accurate tier that fits; if
+        # nothing fits, the cheapest.
+        tiers = self.available_tiers()
+        min_rank = MODEL_TIERS.index(ACCURACY_PROFILES[exercise]['min_tier'])
+        accurate = [tier for tier in tiers if MODEL_TIERS.index(tier) >= min_rank] or tiers[-1:]
+        if budget is None or not frame_count:
+            return accurate[0]
+        if self.cost(accurate[0], frame_count) <= budget:
+            return accurate[0]
+        fits = [tier for tier in tiers if self.cost(tier, frame_count) <= budget]
+        return fits[-1] if fits else tiers[0]
+
+    def run(self, exercise, video_path, budget=None, frame_count=None, tier=None):
+        # With an explicit tier the whole clip runs on it, without escalation
+        if tier is not None:
+            return PoseRun(self, exercise, video_path, tier, self.open(tier, exercise), escalate=False)
+        if budget is not None and frame_count is None:
+            frame_count = probe_video(video_path).frame_count
+        while True:
+            tier = self.plan(exercise, frame_count, budget)
+            try:
+                pose = self.open(tier, exercise)
+            except MODEL_LOAD_ERRORS as e:
+                if tier == 'full':
+                    raise  # Bundled with MediaPipe, nothing to fall back to
+                self.mark_unavailable(tier, e)
+                continue
+            return PoseRun(self, exercise, video_path, tier, pose, budget=budget, frame_count=frame_count)
+
+
+class PoseRun:
+    # Iterates (timestamp, landmarks or None) over the clip. Holds MediaPipe
+    # graphs until exhausted or closed.
+    def __init__(self, engine, exercise, video_path, tier, pose, budget=None, frame_count=None, escalate=True):
+        self.engine = engine
+        self.exercise = exercise
+        self.video_path = video_path
+        self.tier = tier
+        self.budget = budget
+        self.frame_count = frame_count
+        self.escalate = escalate
+        self.frames = 0
+        self.escalated_frames = 0
+        self.elapsed = 0.0
+        self.poses = {tier: pose}
+        self._frames = self._generate()
+
+    def __iter__(self):
+        return self._frames
+
+    def close(self):
+        self._frames.close()
+        for pose in self.poses.values():
+            pose.close()
+        self.poses = {}
+
+    def _heavier_tier(self):
+        tiers = self.engine.available_tiers()
+        heavier = [tier for tier in tiers if MODEL_TIERS.index(tier) > MODEL_TIERS.index(self.tier)]
+        return heavier[0] if heavier else None
+
+    def _can_escalate(self, tier, started):
+        # Room left in the budget for one more frame on `tier`, with the rest
+        # of the clip on the base tier
+        if self.budget is None:
+            return True
+        remaining = max((self.frame_count or self.frames) - self.frames - 1, 0)
+        projected = time.monotonic() - started + self.engine.cost(tier, 1) + self.engine.cost(self.tier, remaining)
+        return projected <= self.budget
+
+    def _pose(self, tier):
+        if tier not in self.poses:
+            self.poses[tier] = self.engine.open(tier, self.exercise)
+        return self.poses[tier]
+
+    def _process(self, tier, frame_rgb):
+        pose = self._pose(tier)
+        start = time.perf_counter()
+        results = pose.process(frame_rgb)
+        self.engine.measured(tier, time.perf_counter() - start)
+        return results.pose_landmarks.landmark if results.pose_landmarks else None
+
+    def _generate(self):
+        profile = ACCURACY_PROFILES[self.exercise]
+        key_landmarks = profile['key_landmarks']
+        started = time.monotonic()
+        heavy_tier = self._heavier_tier() if self.escalate else None
+        escalated_until = -1  # Last frame of the current escalated segment
+        try:
+            for timestamp, frame_rgb in read_frames(self.video_path, max_width=self.engine.max_width):
+                in_segment = self.frames <= escalated_until
+                landmarks = None if in_segment else self._process(self.tier, frame_rgb)
+                escalated = False
+                if heavy_tier is not None and (in_segment or key_visibility(landmarks, key_landmarks)
+                                               < profile['min_visibility']) and self._can_escalate(heavy_tier, started):
+                    try:
+                        heavy_landmarks = self._process(heavy_tier, frame_rgb)
+                    except MODEL_LOAD_ERRORS as e:
+                        self.engine.mark_unavailable(heavy_tier, e)
+                        heavy_tier = None
+                    else:
+                        escalated = True
+                        self.escalated_frames += 1
+                        # The segment lasts until the heavier tier has seen the
+                        # key landmarks clearly for ESCALATION_FRAMES frames
+                        if not in_segment or key_visibility(heavy_landmarks, key_landmarks) < profile['min_visibility']:
+                            escalated_until = self.frames + ESCALATION_FRAMES
+                        if heavy_landmarks is not None or landmarks is None:
+                            landmarks = heavy_landmarks
+                if in_segment and not escalated:
+                    # Out of budget (or no heavier model), back to the base tier
+                    escalated_until = -1
+                    landmarks = self._process(self.tier, frame_rgb)
+                self.frames += 1
+                self.elapsed = time.monotonic() - started
+                yield timestamp, landmarks
+        finally:
+            for pose in self.poses.values():
+                pose.close()
+            self.poses = {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Install MediaPipe Pose model tiers ahead of time")
+    parser.add_argument('command', choices=['fetch', 'list'])
+    parser.add_argument('tiers', nargs='*', help=f"any of {', '.join(MODEL_TIERS)} (default: all)")
+    args = parser.parse_args()
+    unknown = set(args.tiers) - set(MODEL_TIERS)
+    if unknown:
+        parser.error(f"unknown tiers: {', '.join(sorted(unknown))}")
+
+    for tier in args.tiers or MODEL_TIERS:
+        if args.command == 'fetch':
+            print(f"{tier}: {fetch_model(tier)}")
+        else:
+            print(f"{tier}: {'installed' if model_installed(tier) else 'not installed'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+import math
+from collections import namedtuple
+
+import numpy as np
+
+# Rep counting shared by the video analyzers and the landmark upload API.
+#
+# Every counter consumes (timestamp, landmarks) pairs via update(), where the
+# timestamp is in seconds from the start of the clip and landmarks is either
+# None (no pose in that frame) or indexable by MediaPipe pose landmark index,
+# each item exposing .x, .y and .visibility. Both MediaPipe results and
+# landmark_payload frames fit that shape, so nothing here depends on MediaPipe.
+#
+# Landmarks are smoothed by a LandmarkFilter before the counters see them, and
+# each counter tracks its rep position with a RepStateMachine, which only
+# changes state on clearly visible key landmarks and with a hysteresis band
+# around the threshold. Together they keep landmark jitter from counting
+# phantom reps, also on sparsely sampled frames and lighter pose models.
+
+# MediaPipe PoseLandmark indices
+LEFT_SHOULDER = 11
+RIGHT_SHOULDER = 12
+LEFT_ELBOW = 13
+RIGHT_ELBOW = 14
+LEFT_WRIST = 15
+RIGHT_WRIST = 16
+LEFT_HIP = 23
+RIGHT_HIP = 24
+LEFT_KNEE = 25
+RIGHT_KNEE = 26
+NUM_LANDMARKS = 33
+
+REST_THRESHOLD = 10  # Seconds without a rep before it counts as rest
+
+# One Euro filter settings for normalized landmark coordinates
+FILTER_MIN_CUTOFF = 1.5  # Hz, smoothing of slow movement
+FILTER_BETA = 4.0  # How quickly the cutoff rises with speed, to keep lag low in fast reps
+FILTER_D_CUTOFF = 1.0  # Hz, smoothing of the speed estimate
+FILTER_MAX_GAP = 0.5  # Seconds a landmark may go unseen before its filter restarts
+
+MIN_VISIBILITY = 0.5  # Key landmarks below this do not move the rep state machines
+HYSTERESIS = 0.02  # Half-width of the band around each rep threshold, in normalized image units
+
+Landmark = namedtuple('Landmark', ['x', 'y', 'visibility'])
+
+
+def smoothing_factor(dt, cutoff):
+    tau = 1.0 / (2 * math.pi * cutoff)
+    return 1.0 / (1.0 + tau / dt)
+
+
+class LandmarkFilter:
+    # One Euro filter (Casiez et al., 2012) over the x and y of every
+    # landmark, with O(1) state per landmark. Landmarks below MIN_VISIBILITY
+    # are MediaPipe's guesses for hidden joints; they are not fed to the
+    # filter, which holds the last seen position until the landmark is
+    # visible again (or restarts after FILTER_MAX_GAP).
+    def __init__(self, min_cutoff=FILTER_MIN_CUTOFF, beta=FILTER_BETA, d_cutoff=FILTER_D_CUTOFF,
+                 min_visibility=MIN_VISIBILITY, max_gap=FILTER_MAX_GAP):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.min_visibility = min_visibility
+        self.max_gap = max_gap
+        self.position = np.zeros((NUM_LANDMARKS, 2))
+        self.speed = np.zeros((NUM_LANDMARKS, 2))
+        self.last_seen = np.full(NUM_LANDMARKS, -np.inf)
+
+    def update(self, timestamp, landmarks):
+        if landmarks is None:
+            return None
+        if hasattr(landmarks, 'array'):
+            raw = landmarks.array()
+        else:
+            raw = np.array([(l.x, l.y, l.visibility) for l in (landmarks[i] for i in range(NUM_LANDMARKS))])
+        position = raw[:, :2]
+        visibility = raw[:, 2]
+        seen = visibility >= self.min_visibility
+        dt = timestamp - self.last_seen
+        restart = (seen & (dt > self.max_gap))[:, None]
+        tracked = (seen & (dt > 0) & (dt <= self.max_gap))[:, None]
+
+        # Filter every landmark at once, then keep the results for the tracked ones
+        dt = np.where(tracked, dt[:, None], 1.0)
+        speed = self.speed + smoothing_factor(dt, self.d_cutoff) * ((position - self.position) / dt - self.speed)
+        cutoff = self.min_cutoff + self.beta * np.abs(speed)
+        filtered = self.position + smoothing_factor(dt, cutoff) * (position - self.position)
+        self.position = np.where(tracked, filtered, np.where(restart, position, self.position))
+        self.speed = np.where(tracked, speed, np.where(restart, 0.0, self.speed))
+        self.last_seen[seen] = timestamp
+
+        # Landmarks never seen so far pass through unfiltered
+        unseen = np.isinf(self.last_seen)
+        return FilteredLandmarks(np.where(unseen[:, None], position, self.position).tolist(), visibility.tolist())
+
+
+class FilteredLandmarks:
+    # LandmarkFilter output, indexable like MediaPipe's landmark list
+    __slots__ = ('position', 'visibility')
+
+    def __init__(self, position, visibility):
+        self.position = position
+        self.visibility = visibility
+
+    def __getitem__(self, index):
+        x, y = self.position[index]
+        return Landmark(x, y, self.visibility[index])
+
+    def __len__(self):
+        return NUM_LANDMARKS
+
+
+class RepStateMachine:
+    # Two-state rep detector with hysteresis. It enters the rep position when
+    # the enter margin rises above +band, counting a rep, and leaves it only
+    # once the exit margin falls below -band, so a landmark jittering around
+    # the threshold cannot flip it back and forth.
+    def __init__(self, band=HYSTERESIS):
+        self.band = band
+        self.active = False
+
+    def update(self, enter_margin, exit_margin=None):
+        # Returns True when a rep starts
+        if exit_margin is None:
+            exit_margin = enter_margin
+        if not self.active and enter_margin > self.band:
+            self.active = True
+            return True
+        if self.active and exit_margin < -self.band:
+            self.active = False
+        return False
+
+
+class ExerciseCounter:
+    def __init__(self, user_notes):
+        self.form_notes = f"{user_notes}; "
+        self.reps = 0
+        self.rest_period = 0
+        self.start_time = None
+        self.end_time = None
+        self.filter = LandmarkFilter()
+        self.min_visibility = MIN_VISIBILITY
+        self.position = RepStateMachine()
+
+    def update(self, timestamp, landmarks):
+        if self.start_time is None:
+            self.start_time = timestamp
+        self.end_time = timestamp
+        if self.filter is not None:
+            landmarks = self.filter.update(timestamp, landmarks)
+        if landmarks is not None:
+            self.on_pose(timestamp, landmarks)
+
+    def visible(self, *landmarks):
+        # The rep position only changes on landmarks the model actually saw
+        return all(landmark.visibility >= self.min_visibility for landmark in landmarks)
+
+    def on_pose(self, timestamp, landmarks):
+        raise NotImplementedError
+
+    @property
+    def duration(self):
+        if self.start_time is None:
+            return 0
+        return int(self.end_time - self.start_time)
+
+
+class PushUpsCounter(ExerciseCounter):
+    def __init__(self, user_notes):
+        super().__init__(user_notes)
+        self.difficulty = "Beginner"
+
+    def on_pose(self, timestamp, landmarks):
+        left_shoulder = landmarks[LEFT_SHOULDER]
+        left_elbow = landmarks[LEFT_ELBOW]
+        right_shoulder = landmarks[RIGHT_SHOULDER]
+        right_elbow = landmarks[RIGHT_ELBOW]
+        if not self.visible(left_shoulder, left_elbow, right_shoulder, right_elbow):
+            return
+
+        # Detect a push-up movement: both elbows above the shoulders, and back
+        # once both are below
+        left = left_shoulder.y - left_elbow.y
+        right = right_shoulder.y - right_elbow.y
+        if self.position.update(min(left, right), max(left, right)):
+            self.reps += 1
+
+    def result(self):
+        sets = self.reps // 10  # Example: Every 10 reps make a new set
+        calories_burned = self.reps * 0.1  # Simplified formula
+        return self.reps, sets, self.duration, self.difficulty, self.rest_period, calories_burned, self.form_notes
+
+
+class SquatsCounter(ExerciseCounter):
+    def __init__(self, user_notes, weight):
+        super().__init__(user_notes)
+        self.weight = weight
+        self.depth = "Parallel"
+        self.last_squat_time = None
+
+    def on_pose(self, timestamp, landmarks):
+        left_hip = landmarks[LEFT_HIP]
+        left_knee = landmarks[LEFT_KNEE]
+        if self.last_squat_time is None:
+            self.last_squat_time = timestamp
+        if not self.visible(left_hip, left_knee):
+            return
+
+        # Calculate depth of squat based on hip and knee positions
+        if left_hip.y > left_knee.y:
+            self.depth = "Above parallel"
+        elif left_hip.y < left_knee.y:
+            self.depth = "Below parallel"
+        else:
+            self.depth = "Parallel"
+
+        # Detect squat movement based on hip and knee
+        if self.position.update(left_hip.y - left_knee.y):
+            self.reps += 1
+            self.last_squat_time = timestamp
+
+        # Calculate rest period (time between sets)
+        since_last = int(timestamp - self.last_squat_time)
+        self.rest_period = since_last if self.reps > 0 and since_last > REST_THRESHOLD else 0
+
+    def result(self):
+        calories_burned = self.reps * 0.15  # Adjusted for squats
+        return self.reps, 1, self.duration, self.weight, calories_burned, self.rest_period, self.depth, self.form_notes
+
+
+class PlanksCounter(ExerciseCounter):
+    def __init__(self, user_notes, weight):
+        super().__init__(user_notes)
+        self.weight = weight
+        self.stage = "Forearm plank"
+        # Both elbows in view means a forearm plank; the band keeps elbow
+        # visibility hovering around 0.5 from flipping the stage
+        self.position = RepStateMachine(band=0.1)
+
+    def update(self, timestamp, landmarks):
+        super().update(timestamp, landmarks)
+        # Rest is the time spent out of the plank since the clip started
+        self.rest_period = self.duration if not self.position.active else 0
+
+    def on_pose(self, timestamp, landmarks):
+        # Example: Identify pose for forearm vs. side plank
+        left_elbow = landmarks[LEFT_ELBOW]
+        right_elbow = landmarks[RIGHT_ELBOW]
+
+        self.position.update(min(left_elbow.visibility, right_elbow.visibility) - 0.5)
+        self.stage = "Forearm plank" if self.position.active else "Side plank"
+
+    def result(self):
+        calories_burned = self.duration * 0.12  # Calories burned estimate
+        return self.duration, self.stage, self.rest_period, calories_burned, self.form_notes
+
+
+class LungesCounter(ExerciseCounter):
+    def __init__(self, user_notes, weight):
+        super().__init__(user_notes)
+        self.weight = weight
+        self.stance = "Forward Lunge"
+        self.last_lunge_time = None
+
+    def on_pose(self, timestamp, landmarks):
+        left_hip = landmarks[LEFT_HIP]
+        left_knee = landmarks[LEFT_KNEE]
+        if self.last_lunge_time is None:
+            self.last_lunge_time = timestamp
+        if not self.visible(left_hip, left_knee):
+            return
+
+        # Detect lunge stance based on leg position
+        if left_hip.x > left_knee.x:
+            self.stance = "Forward Lunge"
+        else:
+            self.stance = "Reverse Lunge"
+
+        # Detect lunge movement based on knee angle
+        if self.position.update(left_hip.y - left_knee.y):  # Knee above the hip indicates a lunge
+            self.reps += 1
+            self.last_lunge_time = timestamp
+
+        # Calculate rest period (time between sets)
+        since_last = int(timestamp - self.last_lunge_time)
+        self.rest_period = since_last if self.reps > 0 and since_last > REST_THRESHOLD else 0
+
+    def result(self):
+        calories_burned = self.reps * 0.2  # Adjusted for lunges
+        return self.reps, 1, self.duration, self.weight, calories_burned, self.rest_period, self.stance, self.form_notes
+
+
+class PullUpsCounter(ExerciseCounter):
+    def __init__(self, user_notes):
+        super().__init__(user_notes)
+        self.difficulty = "Moderate"  # Default difficulty level
+        self.grip_type = "Neutral"  # Default grip type
+        self.last_pull_time = None
+
+    def on_pose(self, timestamp, landmarks):
+        left_wrist = landmarks[LEFT_WRIST]
+        left_elbow = landmarks[LEFT_ELBOW]
+        left_shoulder = landmarks[LEFT_SHOULDER]
+        if self.last_pull_time is None:
+            self.last_pull_time = timestamp
+        if not self.visible(left_wrist, left_elbow, left_shoulder):
+            return
+
+        # Detect pull-up movement: wrist above elbow above shoulder
+        if self.position.update(min(left_elbow.y - left_wrist.y, left_shoulder.y - left_elbow.y)):
+            self.reps += 1
+            self.last_pull_time = timestamp
+
+        # Calculate rest period
+        since_last = int(timestamp - self.last_pull_time)
+        if self.reps > 0 and since_last > REST_THRESHOLD:
+            self.rest_period = since_last
+
+    def result(self):
+        calories_burned = self.reps * 0.12  # Adjusted for pull-ups
+        return self.reps, 1, self.duration, self.difficulty, calories_burned, self.rest_period, self.grip_type, self.form_notes
+
+
+EXERCISES = ('pushups', 'squats', 'planks', 'lunges', 'pullups')
+
+
+def make_counter(exercise, user_notes, weight=None):
+    if exercise == 'pushups':
+        return PushUpsCounter(user_notes)
+    elif exercise == 'squats':
+        return SquatsCounter(user_notes, weight)
+    elif exercise == 'planks':
+        return PlanksCounter(user_notes, weight)
+    elif exercise == 'lunges':
+        return LungesCounter(user_notes, weight)
+    elif exercise == 'pullups':
+        return PullUpsCounter(user_notes)
+    raise ValueError(f"Unknown exercise: {exercise}")
+
+
+def make_unfiltered_counter(exercise, user_notes, weight=None):
+    # The counters as they were before filtering: raw landmarks, no visibility
+    # check and no hysteresis. Kept for comparison in bench_reps.py.
+    counter = make_counter(exercise, user_notes, weight)
+    counter.filter = None
+    counter.min_visibility = 0.0
+    counter.position.band = 0.0
+    return counter
+
+
+def count_exercise(exercise, frames, user_notes, weight=None):
+    counter = make_counter(exercise, user_notes, weight)
+    for timestamp, landmarks in frames:
+        counter.update(timestamp, landmarks)
+    return counter.result()
@@ -1,8 +1,30 @@
+import os
+import tempfile
+# Run against a scratch database, the fixture drops every table afterwards
+os.environ.setdefault('DATABASE_URI', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db'))
+
 import pytest
-from app import app, db, User, WorkoutLog
+from app import app, db, admission, jobs as upload_jobs, User, PushUpsLog, SquatsLog, PlanksLog, capture_profile_for, upgrade_schema
+from video_decode import VideoDecodeError, save_upload, sniff_container, sniff_codec, probe_video, read_frames
+from rep_counting import LEFT_KNEE, Landmark, LandmarkFilter, NUM_LANDMARKS, RepStateMachine, count_exercise
+from landmark_payload import PayloadError, decode_payload, encode_payload
+from tracker import LatestSlot
+from admission import AdmissionController, AdmissionRejected
+from frame_ring import FrameRing, StaleFrameError
+from jobs import JobCancelled, JobRegistry
+from loadtest import Stats, make_fixture
+from pose_engine import PoseEngine
+from downsample import lttb
+from bench_reps import count as bench_count, synthetic_clip
+import av
 import hashlib  
+import io
+import multiprocessing
+import threading
+import numpy as np
 from flask import session
-from datetime import datetime
+from datetime import datetime, timedelta
+from types import SimpleNamespace
 import warnings
 warnings.filterwarnings("ignore")
 
@@ -15,6 +37,8 @@ def client():
     # Set up a temporary test database
     with app.app_context():
         db.create_all()
+        upgrade_schema()
+        admission.user_buckets.clear()  # User ids are reused between tests
         yield client  # this is where the testing happens
 
         # Drop all tables after tests to reset state
@@ -28,6 +52,7 @@ def hash_password(password):
 def test_signup_success(client):
     response = client.post('/signup', data={
         'username': 'testuser',
+        'email': 'testuser@example.com',
         'password': 'testpassword',
         'age': 25,
         'gender': 'male'
@@ -39,13 +64,15 @@ def test_signup_success(client):
 
 def test_signup_existing_user(client):
     # Create a user
-    user = User(username='existinguser', password=hash_password('password'), age=25, gender='female')
+    user = User(username='existinguser', email='existing@example.com', password=hash_password('password'),
+                age=25, gender='female')
     db.session.add(user)
     db.session.commit()
 
     # Attempt to sign up with the same username
     response = client.post('/signup', data={
         'username': 'existinguser',
+        'email': 'other@example.com',
         'password': 'newpassword',
         'age': 30,
         'gender': 'female'
@@ -63,7 +90,7 @@ def test_login_invalid_credentials(client):
     }, follow_redirects=True)
 
     # Check if the appropriate error message is shown
-    assert b"Invalid credentials" in response.data
+    assert b"Login failed. Check your credentials." in response.data
 
 # Test case for Logout functionality
 def test_logout(client):
@@ -73,7 +100,7 @@ def test_logout(client):
         sess['username'] = 'testuser'
 
     # Logout the user
-    response = client.get('/logout', follow_redirects=True)
+    response = client.post('/logout', follow_redirects=True)
 
     # Ensure the user is logged out
     assert b"You have been logged out." in response.data
@@ -83,28 +110,32 @@ def test_logout(client):
 # Test case for adding a workout log
 def test_add_workout_log(client):
     # Create a test user
-    user = User(username='workoutuser', password=hash_password('password'), age=25, gender='male')
+    user = User(username='workoutuser', email='workout@example.com', password=hash_password('password'),
+                age=25, gender='male')
     db.session.add(user)
     db.session.commit()
 
     # Log in the user
     client.post('/login', data={'username': 'workoutuser', 'password': 'password'}, follow_redirects=True)
 
-    # Simulate workout session and add log
-    with client.session_transaction() as sess:
-        sess['user_id'] = user.id
-
-    response = client.post('/end_workout', data={}, follow_redirects=True)
+    # Upload a workout as browser-extracted landmarks
+    payload = encode_payload([(i / 10.0, fake_pose(-0.1 if i % 10 < 5 else 0.1)) for i in range(40)])
+    response = client.post('/capture_landmarks/pushups', data={
+        'landmarks': (io.BytesIO(payload), 'landmarks.bin'),
+        'notes': 'felt good'
+    })
 
     # Check if the workout log has been added
-    workout_log = WorkoutLog.query.filter_by(user_id=user.id).first()
+    assert response.get_json()['status'] == 'success'
+    workout_log = PushUpsLog.query.filter_by(user_id=user.id).first()
     assert workout_log is not None
-    assert b"Workout session ended. Data has been logged." in response.data
+    assert workout_log.reps == 4 and 'felt good' in workout_log.form_notes
 
 # Test case to check dashboard display for logged-in user
 def test_dashboard(client):
     # Create a test user and log them in
-    user = User(username='dashboarduser', password=hash_password('password'), age=25, gender='male')
+    user = User(username='dashboarduser', email='dashboard@example.com', password=hash_password('password'),
+                age=25, gender='male')
     db.session.add(user)
     db.session.commit()
 
@@ -113,22 +144,475 @@ def test_dashboard(client):
 
     response = client.get('/dashboard')
     assert response.status_code == 200
-    assert b"Your Workout Logs" in response.data
+    assert b"Welcome to Your Fitness Tracker, dashboarduser" in response.data
 
 
-# Test case for workout session start and end
-def test_workout_start_end(client):
+# Test case for starting a workout
+def test_start_workout(client):
     # Create a test user and log them in
-    user = User(username='workoutuser2', password=hash_password('password'), age=25, gender='male')
+    user = User(username='workoutuser2', email='workout2@example.com', password=hash_password('password'),
+                age=25, gender='male')
     db.session.add(user)
     db.session.commit()
 
     client.post('/login', data={'username': 'workoutuser2', 'password': 'password'}, follow_redirects=True)
 
-    # Start workout session
-    client.get('/workout')
-    assert client.get('/video_feed').status_code == 200  # Confirm the video feed starts
+    # Starting a workout leads to its capture page
+    response = client.get('/start_workout/squats', follow_redirects=True)
+    assert response.status_code == 200
+    assert b"/capture_video/squats" in response.data
+
+    # Unknown exercises go back to the dashboard
+    response = client.get('/start_workout/juggling', follow_redirects=True)
+    assert b"Invalid exercise" in response.data
+
+
+# Test cases for the upload decode layer
+def test_sniff_container():
+    webm_head = b'\x1a\x45\xdf\xa3\x9f\x42\x86\x81\x01\x42\x82\x84webm' + b'\x00' * 32 + b'V_VP8'
+    assert sniff_container(webm_head) == 'webm'
+    assert sniff_codec(webm_head, 'webm') == 'vp8'
+    assert sniff_container(b'\x00\x00\x00\x20ftypisom' + b'\x00' * 16) == 'mp4'
+    assert sniff_container(b'not a video') is None
+
+
+def test_probe_recorded_video():
+    info = probe_video('reference_clips/squats.mkv')
+    assert info.container in ('webm', 'matroska')
+    assert info.frame_count > 0 and info.duration > 0
+
+    frames = list(read_frames('reference_clips/squats.mkv', max_width=320))
+    assert len(frames) == info.frame_count
+    assert frames[0][1].shape == (240, 320, 3)
+
+    # Timestamps after a seek stay relative to the start of the video
+    for backend in ('pyav', 'opencv'):
+        seeked = list(read_frames('reference_clips/squats.mkv', start=0.5, backend=backend))
+        assert 0.5 <= seeked[0][0] < 0.6 and seeked[0][0] == pytest.approx(frames[-len(seeked)][0])
+
+def test_audio_only_upload_is_rejected(client, tmp_path, monkeypatch):
+    path = str(tmp_path / 'audio.webm')
+    with av.open(path, 'w') as container:
+        stream = container.add_stream('libopus', rate=48000)
+        frame = av.AudioFrame.from_ndarray(np.zeros((1, 960), dtype=np.int16), format='s16', layout='mono')
+        frame.sample_rate = 48000
+        for packet in list(stream.encode(frame)) + list(stream.encode(None)):
+            container.mux(packet)
+    with pytest.raises(VideoDecodeError):
+        read_frames(path)
+
+    monkeypatch.chdir(tmp_path)  # The upload is saved under captured_videos/
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+    with open(path, 'rb') as f:
+        response = client.post('/capture_video/squats', data={'video': (f, 'squats_video.mp4')})
+    assert response.status_code == 400 and response.get_json()['message'] == "Upload has no video track"
+
+def test_each_upload_is_analyzed_from_its_own_file(client, tmp_path, monkeypatch):
+    saved = []
+
+    def save(file_storage, base_path):
+        saved.append(save_upload(file_storage, base_path))
+        return saved[-1]
+
+    clip = os.path.abspath('reference_clips/squats.mkv')
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr('app.save_upload', save)
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+    for notes in ('first', 'second'):  # Different keys, so not a duplicate
+        with open(clip, 'rb') as f:
+            response = client.post('/capture_video/squats', data={'video': (f, 'squats_video.mp4'), 'notes': notes},
+                                   headers={'Idempotency-Key': notes})
+        assert response.status_code == 200
+    assert len(set(saved)) == 2
+    assert not os.listdir(tmp_path / 'captured_videos')  # Removed once analyzed
+
+
+# Test cases for the landmark upload format
+def fake_pose(offset):
+    # Shoulders above elbows by `offset`, hips well below the shoulders
+    landmarks = [Landmark(0.5, 0.5, 0.9)] * NUM_LANDMARKS
+    landmarks[11] = landmarks[12] = Landmark(0.5, 0.4, 0.9)
+    landmarks[13] = landmarks[14] = Landmark(0.5, 0.4 + offset, 0.9)
+    landmarks[23] = landmarks[24] = Landmark(0.5, 0.7, 0.9)
+    return landmarks
+
+def test_landmark_payload_round_trip():
+    frames = [(i / 10.0, fake_pose(-0.1 if i % 10 < 5 else 0.1)) for i in range(40)]
+    frames[3] = (0.3, None)
+    decoded = decode_payload(encode_payload(frames))
+
+    assert len(decoded) == 40
+    assert decoded[3][1] is None
+    assert abs(decoded[0][1][13].y - 0.3) < 1e-3
+    assert count_exercise('pushups', decoded, '')[0] == count_exercise('pushups', frames, '')[0] == 4
+
+def test_landmark_payload_rejects_implausible_data():
+    payload = encode_payload([(0.0, fake_pose(0.1)), (0.0, fake_pose(0.1))])
+    with pytest.raises(PayloadError):
+        decode_payload(payload)  # Timestamps not increasing
+    with pytest.raises(PayloadError):
+        decode_payload(b'FTLM')
+    with pytest.raises(PayloadError):
+        decode_payload(encode_payload([(0.0, [Landmark(0.5, 0.5, 1.0)] * NUM_LANDMARKS)]))
+
+
+# Test case for the live tracker frame handoff
+def test_latest_slot_drops_stale_frames():
+    slot = LatestSlot()
+    for i in range(3):
+        slot.put(i)
+    assert slot.get(timeout=0) == 2
+    assert slot.dropped == 2
+    assert slot.get(timeout=0) is None
+    slot.close()
+    assert slot.get() is None
+
+def test_latest_slot_waits_for_file_frames():
+    slot = LatestSlot()
+
+    def read_file():
+        for i in range(5):
+            slot.put(i, wait=True)
+        slot.close()
+
+    producer = threading.Thread(target=read_file)
+    producer.start()
+    received = []
+    while True:
+        item = slot.get(timeout=1)
+        if item is None:
+            break
+        received.append(item)
+    producer.join()
+    assert received == list(range(5)) and slot.dropped == 0
+
+
+# Test cases for upload admission control
+def test_admission_rejects_when_saturated(tmp_path):
+    config_path = tmp_path / 'admission.json'
+    config_path.write_text('{"max_concurrent": 1, "max_queue": 1, "queue_timeout": 0.1}')
+    admission = AdmissionController(str(config_path))
+
+    running = admission.admit(1, 1000)
+    running.start_analysis('reference_clips/squats.mkv')
+    queued = admission.admit(2, 1000)
+    with pytest.raises(AdmissionRejected) as rejected:
+        admission.admit(3, 1000)
+    assert rejected.value.status == 503 and rejected.value.retry_after >= 1
+
+    with pytest.raises(AdmissionRejected):
+        queued.start_analysis('reference_clips/squats.mkv')  # Times out waiting for a slot
+    queued.__exit__(AdmissionRejected, None, None)
+    running.__exit__(None, None, None)
+    assert admission.active == 0 and admission.waiting == 0
+
+def test_admission_rate_and_size_limits(tmp_path):
+    config_path = tmp_path / 'admission.json'
+    config_path.write_text('{"user_rate": 1, "user_burst": 1, "max_upload_mb": 1}')
+    admission = AdmissionController(str(config_path))
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        admission.admit(1, 2 * 1024 * 1024)
+    assert rejected.value.status == 413
+    with admission.admit(1, 1000, queued=False):
+        pass
+    with pytest.raises(AdmissionRejected) as rejected:
+        admission.admit(1, 1000, queued=False)
+    assert rejected.value.status == 429 and rejected.value.retry_after > 0
+
+
+# Test case for the capture profile negotiation
+def test_capture_profile(client):
+    response = client.get('/capture_profile/squats')
+    assert response.status_code == 200
+    profile = response.get_json()
+    assert profile['width'] <= 640 and profile['frameRate'] <= 15
+    assert profile['mimeTypes'][0].startswith('video/webm')
+
+    busy = capture_profile_for('squats', 2.0)
+    assert busy['frameRate'] < profile['frameRate']
+    assert busy['videoBitsPerSecond'] < profile['videoBitsPerSecond']
+    assert client.get('/capture_profile/unknown').status_code == 404
+
+
+# Test cases for the shared-memory frame ring
+def claim_and_crash(ring, desc):
+    ring.claim(desc)
+    os._exit(1)
+
+def dequeue_and_crash(queue):
+    queue.get()
+    os._exit(1)
+
+def test_frame_ring_round_trip():
+    with FrameRing(slots=2, slot_bytes=64 * 64 * 3) as ring:
+        frame = np.random.randint(0, 255, (64, 64, 3), dtype=np.uint8)
+        desc = ring.put(frame, timestamp=1.5)
+        with ring.open(desc) as view:
+            assert np.array_equal(view, frame)
+            assert not view.flags.writeable
+        assert ring.in_use() == 0
+        with pytest.raises(StaleFrameError):
+            ring.claim(desc)
+
+def test_frame_ring_reclaims_crashed_worker():
+    with FrameRing(slots=1, slot_bytes=16) as ring:
+        desc = ring.put(np.zeros(16, dtype=np.uint8))
+        worker = multiprocessing.Process(target=claim_and_crash, args=(ring, desc))
+        worker.start()
+        worker.join()
+        assert ring.in_use() == 1
+        # A new frame gets the slot back once the dead worker's reference is dropped
+        ring.put(np.ones(16, dtype=np.uint8), timeout=1)
+
+def test_frame_ring_expires_unclaimed_frames():
+    with FrameRing(slots=1, slot_bytes=16, claim_timeout=1.0) as ring:
+        # The worker takes the descriptor off the queue but dies before claiming it
+        queue = multiprocessing.Queue()
+        desc = ring.put(np.zeros(16, dtype=np.uint8))
+        queue.put(desc)
+        worker = multiprocessing.Process(target=dequeue_and_crash, args=(queue,))
+        worker.start()
+        worker.join()
+        assert ring.reclaim() == 0  # Still within the lease
+        ring.put(np.ones(16, dtype=np.uint8), timeout=3)
+        with pytest.raises(StaleFrameError):
+            ring.claim(desc)
+
+
+# Test case for analysis progress and cancellation
+def test_analysis_job_cancellation():
+    registry = JobRegistry()
+    with pytest.raises(JobCancelled):
+        with registry.track('job-12345678', 1, 'squats') as job:
+            job.start(10)
+            job.advance(1)
+            assert job.status()['frames'] == 1 and job.status()['eta'] is not None
+            registry.get('job-12345678', 1).cancel()
+            job.advance(1)
+    assert job.status()['state'] == 'cancelled'
+    assert registry.get('job-12345678', 2) is None  # Other users cannot see it
+    assert registry.create('bad id!', 1, 'squats').id != 'bad id!'
+
+def test_retried_upload_attaches_to_running_job():
+    registry = JobRegistry()
+    with registry.track('first-1234', 1, 'squats', 'key:abc') as job:
+        retry = registry.track('retry-1234', 1, 'squats', 'key:abc')
+        assert retry.attached and retry.job is job
+        assert registry.get('retry-1234', 1) is job
+        assert not registry.track('other-1234', 2, 'squats', 'key:abc').attached
+    assert job.wait_finished(timeout=0) and job.state == 'done'
+    assert not registry.track('again-1234', 1, 'squats', 'key:abc').attached
+
+def test_reused_job_id_does_not_replace_a_job():
+    registry = JobRegistry()
+    job = registry.create('job-12345678', 1, 'squats')
+    other = registry.create('job-12345678', 2, 'squats')  # Another user picks the same id
+    assert other.id != job.id and registry.get('job-12345678', 1) is job
+    with registry.track('job-12345678', 1, 'squats', 'key:abc') as again:  # Or the owner reuses it
+        assert again.id != job.id
+        running = registry.track('retry-1234', 1, 'squats', 'key:abc')
+        assert running.attached and registry.get('retry-1234', 1) is again
+    registry.alias('job-12345678', again)
+    assert registry.get('job-12345678', 1) is job
+
+
+# Test case for duplicate upload detection
+def test_duplicate_landmark_upload_is_logged_once(client):
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+    payload = encode_payload([(i / 10.0, fake_pose(-0.1 if i % 10 < 5 else 0.1)) for i in range(40)])
+
+    def upload(**headers):
+        return client.post('/capture_landmarks/squats', headers=headers,
+                           data={'landmarks': (io.BytesIO(payload), 'landmarks.bin')})
+
+    first = upload().get_json()
+    assert first['status'] == 'success' and 'duplicate' not in first
+    retry = upload().get_json()  # Same content
+    assert retry['duplicate'] and retry['log'] == first['log']
+    assert {'id', 'reps', 'duration'} <= set(first['log']) and not {'upload_key', 'user_id'} & set(first['log'])
+    assert SquatsLog.query.filter_by(user_id=1).count() == 1
+
+    with client.session_transaction() as sess:
+        sess['user_id'] = 2  # Own upload rate limit
+    assert not upload(**{'Idempotency-Key': 'recording-1'}).get_json().get('duplicate')
+    assert upload(**{'Idempotency-Key': 'recording-1'}).get_json()['duplicate']
+    assert SquatsLog.query.filter_by(user_id=2).count() == 1
+
+def test_keyed_retries_skip_admission_limits(client):
+    assert client.post('/capture_video/squats', data={}).status_code == 401
+    with client.session_transaction() as sess:
+        sess['user_id'] = 3
+    payload = encode_payload([(i / 10.0, fake_pose(-0.1 if i % 10 < 5 else 0.1)) for i in range(40)])
+    headers = {'Idempotency-Key': 'rec-1'}
+    assert client.post('/capture_landmarks/squats', headers=headers,
+                       data={'landmarks': (io.BytesIO(payload), 'landmarks.bin')}).status_code == 200
+    for _ in range(5):
+        response = client.post('/capture_landmarks/squats', headers=headers,
+                               data={'landmarks': (io.BytesIO(payload), 'landmarks.bin')})
+        assert response.status_code == 200 and response.get_json()['duplicate']
+
+    # A retry of a video still being analyzed waits for it outside the queue
+    tracked = upload_jobs.track('original-1234', 3, 'squats', 'key:rec-2')
+    threading.Timer(0.2, tracked.__exit__, (None, None, None)).start()
+    response = client.post('/capture_video/squats', headers={'Idempotency-Key': 'rec-2'},
+                           data={'job_id': 'retry-1234'})
+    assert response.status_code == 409 and 'done' in response.get_json()['message']
+    assert upload_jobs.get('retry-1234', 3) is tracked.job
+    assert admission.user_buckets[3].tokens >= 1 and admission.waiting == 0
+
+
+# Test case for the load-test tool
+def test_load_test_fixture_and_report(tmp_path):
+    path = make_fixture(str(tmp_path / 'fixture.webm'), seconds=1, width=320, height=240)
+    info = probe_video(path)
+    assert (info.width, info.height) == (320, 240) and info.frame_count == 15
+
+    stats = Stats()
+    for i in range(10):
+        stats.record('dashboard', 0, 0.01 * (i + 1), 200)
+    stats.record('upload', 0, 1.0, 429)
+    stats.record('upload', 0, 1.0, 500)
+    rows = stats.summary(2.0)
+    assert rows['dashboard']['p50'] == pytest.approx(0.055) and rows['dashboard']['throughput'] == 5.0
+    assert rows['upload']['rejected'] == 1 and rows['upload']['errors'] == 1
+    assert rows['total']['requests'] == 12
+
+
+# Test cases for pose model tier selection
+class FakePose:
+    # Stands in for a MediaPipe graph: only the heavy tier sees the key
+    # landmarks clearly
+    def __init__(self, tier):
+        self.tier = tier
+
+    def process(self, image):
+        visibility = 0.9 if self.tier == 'heavy' else 0.2
+        landmark = [Landmark(0.5, 0.5, visibility)] * NUM_LANDMARKS
+        return SimpleNamespace(pose_landmarks=SimpleNamespace(landmark=landmark))
+
+    def close(self):
+        pass
+
+class FakePoseEngine(PoseEngine):
+    # Every tier counts as installed
+    def installed(self, tier):
+        return True
+
+    def open(self, tier, exercise):
+        return FakePose(tier)
+
+def test_pose_engine_plan_fits_budget():
+    engine = FakePoseEngine()
+    engine.seconds_per_frame = {'lite': 0.01, 'full': 0.02, 'heavy': 0.05}
+    assert engine.plan('squats', 300, budget=60) == 'full'  # Accuracy target
+    assert engine.plan('pullups', 300, budget=4) == 'lite'  # Over budget, degrade
+    assert engine.plan('pullups', 300, budget=1) == 'lite'  # Nothing fits, cheapest
+    engine.unavailable.add('lite')
+    assert engine.plan('pullups', 300, budget=4) == 'full'
+
+    # Models that were not fetched ahead of time are never used
+    engine = PoseEngine()
+    engine.installed = lambda tier: tier == 'full'
+    engine.seconds_per_frame = {'lite': 0.01, 'full': 0.02, 'heavy': 0.05}
+    assert engine.available_tiers() == ['full'] and engine.plan('pullups', 300, budget=4) == 'full'
+
+def test_pose_engine_escalates_low_visibility_within_budget():
+    engine = FakePoseEngine(max_width=160)
+    run = engine.run('squats', 'reference_clips/squats.mkv')
+    frames = list(run)
+    assert run.tier == 'full' and run.escalated_frames == len(frames)
+    assert all(landmarks[LEFT_KNEE].visibility == 0.9 for timestamp, landmarks in frames)
+
+    # No budget left for the heavier tier: everything stays on full
+    engine.seconds_per_frame = {'lite': 0.001, 'full': 0.001, 'heavy': 10.0}
+    run = engine.run('squats', 'reference_clips/squats.mkv', budget=5)
+    assert sum(1 for _ in run) == len(frames) and run.escalated_frames == 0
+
+
+# Test cases for the workout log API
+def add_logs(user_id, days):
+    for day in range(days):
+        date = datetime(2024, 1, 1) + timedelta(days=day)
+        db.session.add(SquatsLog(user_id=user_id, date=date, reps=day % 7, sets=1, duration=60, calories_burned=1.5))
+        db.session.add(PlanksLog(user_id=user_id, date=date, duration=30 + day))
+    db.session.commit()
+
+def test_api_logs_delta_sync(client):
+    add_logs(1, 5)
+    add_logs(2, 3)
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+
+    first = client.get('/api/logs?exercise=squats,planks&limit=3&fields=date,reps').get_json()
+    assert first['hasMore'] and len(first['logs']['squats']) == 3
+    assert set(first['logs']['squats'][0]) == {'id', 'date', 'reps'}
+    assert set(first['logs']['planks'][0]) == {'id', 'date'}  # Planks have no reps
+
+    rest = client.get('/api/logs?limit=3&cursor=' + first['cursor']).get_json()
+    assert not rest['hasMore'] and len(rest['logs']['squats']) == 2 and rest['logs']['pushups'] == []
+    assert 'upload_key' not in rest['logs']['squats'][0]
+
+    # Nothing new since the last cursor, until another log is added
+    assert client.get('/api/logs?cursor=' + rest['cursor']).get_json()['logs']['squats'] == []
+    add_logs(1, 1)
+    assert len(client.get('/api/logs?cursor=' + rest['cursor']).get_json()['logs']['squats']) == 1
+
+    since = client.get('/api/logs?exercise=squats&since=2024-01-03').get_json()
+    assert [log['date'][:10] for log in since['logs']['squats']] == ['2024-01-04', '2024-01-05']
+    assert client.get('/api/logs?fields=nope').status_code == 400
+    assert client.get('/api/logs?cursor=garbage').status_code == 400
+
+def test_api_series_downsampled(client):
+    add_logs(1, 60)
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+
+    series = client.get('/api/series/reps?points=10').get_json()
+    assert series['days'] == 60 and len(series['points']) == 10
+    assert series['points'][0] == {'date': '2024-01-01', 'value': 0}
+    assert series['points'][-1]['date'] == '2024-02-29'
+
+    full = client.get('/api/series/duration?exercise=planks&points=100').get_json()
+    assert len(full['points']) == 60 and full['points'][1]['value'] == 31
+    assert client.get('/api/series/weight').status_code == 404
+
+def test_lttb_keeps_peaks():
+    xs = np.arange(1000)
+    ys = np.sin(xs / 50.0)
+    ys[500] = 5
+    kept = lttb(xs, ys, 50)
+    assert len(kept) == 50 and kept[0] == 0 and kept[-1] == 999 and 500 in kept
+    assert lttb(xs[:5], ys[:5], 10) == [0, 1, 2, 3, 4]
+
+
+# Test cases for landmark filtering and the rep state machines
+def test_landmark_filter_smooths_and_gates_on_visibility():
+    landmark_filter = LandmarkFilter()
+    rng = np.random.default_rng(0)
+    errors = []
+    for i in range(60):
+        y = 0.5 + rng.normal(0, 0.02)
+        smoothed = landmark_filter.update(i / 30.0, [Landmark(0.5, y, 0.9)] * NUM_LANDMARKS)
+        errors.append(abs(smoothed[LEFT_KNEE].y - 0.5))
+    assert np.mean(errors[10:]) < 0.01
+
+    # A hidden joint's guessed position is ignored
+    held = smoothed[LEFT_KNEE].y
+    smoothed = landmark_filter.update(2.0, [Landmark(0.1, 0.9, 0.1)] * NUM_LANDMARKS)
+    assert smoothed[LEFT_KNEE].y == held and smoothed[LEFT_KNEE].visibility == 0.1
+
+def test_rep_state_machine_hysteresis():
+    position = RepStateMachine(band=0.02)
+    margins = [-0.05, 0.03, -0.01, 0.03, -0.01, 0.03, -0.03, 0.03]
+    assert [position.update(margin) for margin in margins] == [False, True, False, False, False, False, False, True]
 
-    # End workout session
-    response = client.post('/end_workout', follow_redirects=True)
-    assert b"Workout session ended. Data has been logged." in response.data
+def test_filtered_counts_survive_jitter_and_sparse_sampling():
+    for exercise in ('pushups', 'squats', 'pullups'):
+        frames = synthetic_clip(exercise, 6, jitter=0.015, occlusion=0.02)
+        assert bench_count(exercise, frames, 1, filtered=False) > 6  # Phantom reps
+        for stride in (1, 3, 5):
+            assert bench_count(exercise, frames, stride, filtered=True) == 6
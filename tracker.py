@@ -1,3 +1,9 @@
+import argparse
+import os
+import threading
+import time
+from datetime import datetime
+
 import cv2
 import mediapipe as mp
 import numpy as np
@@ -8,95 +14,240 @@ def calculate_angle(a,b,c):
     a = np.array(a) # First
     b = np.array(b) # Mid
     c = np.array(c) # End
-    
+
     radians = np.arctan2(c[1]-b[1], c[0]-b[0]) - np.arctan2(a[1]-b[1], a[0]-b[0])
     angle = np.abs(radians*180.0/np.pi)
-    
+
     if angle >180.0:
         angle = 360-angle
-        
-    return angle 
 
-cap = cv2.VideoCapture(0)
+    return angle
+
+
+class LatestSlot:
+    # Single-item handoff between threads. Putting a new item replaces one
+    # that was never taken, so consumers always get the freshest frame and
+    # stale ones are dropped instead of queueing up behind a slow stage.
+    # put(item, wait=True) instead waits until the previous item was taken,
+    # for sources where no frame should be lost.
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.item = None
+        self.seq = 0
+        self.taken_seq = 0
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, item, wait=False):
+        with self.cond:
+            if wait:
+                self.cond.wait_for(lambda: self.seq == self.taken_seq or self.closed)
+            if self.closed:
+                return
+            if self.seq > self.taken_seq:
+                self.dropped += 1
+            self.item = item
+            self.seq += 1
+            self.cond.notify_all()
+
+    def get(self, timeout=None):
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq > self.taken_seq or self.closed, timeout)
+            if self.seq == self.taken_seq:
+                return None
+            self.taken_seq = self.seq
+            self.cond.notify_all()
+            return self.item
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
 
-# Curl counter variables
-counter = 0 
-stage = None
+class CurlCounter:
+    def __init__(self):
+        self.counter = 0
+        self.stage = None
 
-## Setup mediapipe instance
-with mp_pose.Pose(min_detection_confidence=0.5, min_tracking_confidence=0.5) as pose:
-    while cap.isOpened():
+    def update(self, angle):
+        # Curl counter logic; returns True when a rep was completed
+        if angle > 160:
+            self.stage = "down"
+        if angle < 30 and self.stage =='down':
+            self.stage="up"
+            self.counter +=1
+            return True
+        return False
+
+
+def capture_loop(cap, frames, stop, file_fps=None):
+    # Cameras and streams keep going at their own pace and stale frames are
+    # dropped. Video files are read at their frame rate (or slower, if
+    # inference cannot keep up) without dropping any frame.
+    started = time.monotonic()
+    index = 0
+    while not stop.is_set() and cap.isOpened():
         ret, frame = cap.read()
-        
-        # Recolor image to RGB
-        image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        image.flags.writeable = False
-      
-        # Make detection
-        results = pose.process(image)
-    
-        # Recolor back to BGR
-        image.flags.writeable = True
-        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-        
-        # Extract landmarks
-        try:
-            landmarks = results.pose_landmarks.landmark
-            
-            # Get coordinates
-            shoulder = [landmarks[mp_pose.PoseLandmark.LEFT_SHOULDER.value].x,landmarks[mp_pose.PoseLandmark.LEFT_SHOULDER.value].y]
-            elbow = [landmarks[mp_pose.PoseLandmark.LEFT_ELBOW.value].x,landmarks[mp_pose.PoseLandmark.LEFT_ELBOW.value].y]
-            wrist = [landmarks[mp_pose.PoseLandmark.LEFT_WRIST.value].x,landmarks[mp_pose.PoseLandmark.LEFT_WRIST.value].y]
-            
-            # Calculate angle
-            angle = calculate_angle(shoulder, elbow, wrist)
-            
-            # Visualize angle
-            cv2.putText(image, str(angle), 
-                           tuple(np.multiply(elbow, [640, 480]).astype(int)), 
+        if not ret:
+            break
+        if file_fps:
+            stop.wait(max(0.0, started + index / file_fps - time.monotonic()))
+            index += 1
+        frames.put((time.monotonic(), frame), wait=file_fps is not None)
+    frames.close()
+
+
+def inference_loop(frames, results_slot, stop, headless):
+    curl = CurlCounter()
+    image = None  # RGB buffer reused across frames
+    with mp_pose.Pose(min_detection_confidence=0.5, min_tracking_confidence=0.5) as pose:
+        while not stop.is_set():
+            item = frames.get(timeout=0.5)
+            if item is None:
+                if frames.closed:
+                    break  # Camera or stream ended
+                continue
+            captured_at, frame = item
+
+            # Recolor image to RGB
+            if image is None or image.shape != frame.shape:
+                image = np.empty_like(frame)
+            cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=image)
+            image.flags.writeable = False
+            results = pose.process(image)
+            image.flags.writeable = True
+
+            angle = None
+            elbow = None
+            if results.pose_landmarks:
+                landmarks = results.pose_landmarks.landmark
+
+                # Get coordinates
+                shoulder = [landmarks[mp_pose.PoseLandmark.LEFT_SHOULDER.value].x,landmarks[mp_pose.PoseLandmark.LEFT_SHOULDER.value].y]
+                elbow = [landmarks[mp_pose.PoseLandmark.LEFT_ELBOW.value].x,landmarks[mp_pose.PoseLandmark.LEFT_ELBOW.value].y]
+                wrist = [landmarks[mp_pose.PoseLandmark.LEFT_WRIST.value].x,landmarks[mp_pose.PoseLandmark.LEFT_WRIST.value].y]
+
+                # Calculate angle
+                angle = calculate_angle(shoulder, elbow, wrist)
+                if curl.update(angle):
+                    latency = (time.monotonic() - captured_at) * 1000
+                    if headless:
+                        print(f"{datetime.now().isoformat(timespec='milliseconds')} rep={curl.counter} latency_ms={latency:.0f}", flush=True)
+                    else:
+                        print(curl.counter)
+
+            results_slot.put((captured_at, frame, results.pose_landmarks, angle, elbow, curl.counter, curl.stage))
+    frames.close()  # Releases a capture thread waiting to hand over a file frame
+    results_slot.close()
+    stop.set()
+
+
+def render_loop(results_slot, frames, stop):
+    overlay = None  # Display buffer reused across frames
+    fps = 0.0
+    last_shown = None
+    while not stop.is_set():
+        item = results_slot.get(timeout=0.5)
+        if item is None:
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+            continue
+        captured_at, frame, pose_landmarks, angle, elbow, counter, stage = item
+
+        if overlay is None or overlay.shape != frame.shape:
+            overlay = np.empty_like(frame)
+        np.copyto(overlay, frame)
+        height, width = overlay.shape[:2]
+
+        # Visualize angle
+        if angle is not None:
+            cv2.putText(overlay, str(int(angle)),
+                           tuple(np.multiply(elbow, [width, height]).astype(int)),
                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2, cv2.LINE_AA
                                 )
-            
-            # Curl counter logic
-            if angle > 160:
-                stage = "down"
-            if angle < 30 and stage =='down':
-                stage="up"
-                counter +=1
-                print(counter)
-                       
-        except:
-            pass
-        
+
         # Render curl counter
         # Setup status box
-        cv2.rectangle(image, (0,0), (225,73), (245,117,16), -1)
-        
+        cv2.rectangle(overlay, (0,0), (225,73), (245,117,16), -1)
+
         # Rep data
-        cv2.putText(image, 'REPS', (15,12), 
+        cv2.putText(overlay, 'REPS', (15,12),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0,0,0), 1, cv2.LINE_AA)
-        cv2.putText(image, str(counter), 
-                    (10,60), 
+        cv2.putText(overlay, str(counter),
+                    (10,60),
                     cv2.FONT_HERSHEY_SIMPLEX, 2, (255,255,255), 2, cv2.LINE_AA)
-        
+
         # Stage data
-        cv2.putText(image, 'STAGE', (65,12), 
+        cv2.putText(overlay, 'STAGE', (65,12),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0,0,0), 1, cv2.LINE_AA)
-        cv2.putText(image, stage, 
-                    (60,60), 
+        cv2.putText(overlay, stage or '',
+                    (60,60),
                     cv2.FONT_HERSHEY_SIMPLEX, 2, (255,255,255), 2, cv2.LINE_AA)
-        
-        
+
+        # Latency from camera read to display, and displayed frame rate
+        now = time.monotonic()
+        if last_shown is not None and now > last_shown:
+            fps = 0.9 * fps + 0.1 / (now - last_shown) if fps else 1.0 / (now - last_shown)
+        last_shown = now
+        cv2.putText(overlay, f'LATENCY {(now - captured_at) * 1000:.0f} ms  FPS {fps:.1f}  DROPPED {frames.dropped}',
+                    (10, height - 12), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255,255,255), 1, cv2.LINE_AA)
+
         # Render detections
-        mp_drawing.draw_landmarks(image, results.pose_landmarks, mp_pose.POSE_CONNECTIONS,
-                                mp_drawing.DrawingSpec(color=(245,117,66), thickness=2, circle_radius=2), 
-                                mp_drawing.DrawingSpec(color=(245,66,230), thickness=2, circle_radius=2) 
-                                 )               
-        
-        cv2.imshow('Mediapipe Feed', image)
-
-        if cv2.waitKey(10) & 0xFF == ord('q'):
+        mp_drawing.draw_landmarks(overlay, pose_landmarks, mp_pose.POSE_CONNECTIONS,
+                                mp_drawing.DrawingSpec(color=(245,117,66), thickness=2, circle_radius=2),
+                                mp_drawing.DrawingSpec(color=(245,66,230), thickness=2, circle_radius=2)
+                                 )
+
+        cv2.imshow('Mediapipe Feed', overlay)
+
+        if cv2.waitKey(1) & 0xFF == ord('q'):
             break
+    stop.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Live curl counter")
+    parser.add_argument('--camera', default='0', help="camera index or video file/stream URL")
+    parser.add_argument('--headless', action='store_true',
+                        help="log rep events with timestamps instead of opening a window")
+    args = parser.parse_args()
+
+    cap = cv2.VideoCapture(int(args.camera) if args.camera.isdigit() else args.camera)
+    # Keep the driver from buffering frames we would only drop later
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    file_fps = None
+    if os.path.isfile(args.camera):
+        file_fps = cap.get(cv2.CAP_PROP_FPS)
+        file_fps = file_fps if 0 < file_fps <= 240 else 30.0  # Live-recorded WebM reports nonsense
+
+    frames = LatestSlot()
+    results_slot = LatestSlot()
+    stop = threading.Event()
+    capture = threading.Thread(target=capture_loop, args=(cap, frames, stop, file_fps), daemon=True)
+    inference = threading.Thread(target=inference_loop, args=(frames, results_slot, stop, args.headless), daemon=True)
+    capture.start()
+    inference.start()
+
+    try:
+        if args.headless:
+            while not stop.is_set():
+                stop.wait(1.0)
+        else:
+            # HighGUI windows have to be driven from the main thread
+            render_loop(results_slot, frames, stop)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        inference.join()
+        capture.join()
+        cap.release()
+        if not args.headless:
+            cv2.destroyAllWindows()
+        else:
+            print(f"{datetime.now().isoformat(timespec='milliseconds')} stopped, dropped_frames={frames.dropped}", flush=True)
+
 
-    cap.release()
-    cv2.destroyAllWindows()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+import logging
+import os
+from collections import namedtuple
+
+import cv2
+
+# PyAV is optional: it gives us multi-threaded decoding, keyframe seeking and
+# scaling inside the decoder. Without it we fall back to cv2.VideoCapture.
+try:
+    import av
+except ImportError:
+    av = None
+
+
+# Browsers' MediaRecorder normally produces WebM (VP8/VP9, sometimes H.264),
+# Safari produces MP4. Uploads are sniffed instead of trusting the file name.
+CONTAINER_EXTENSIONS = {
+    'webm': '.webm',
+    'matroska': '.mkv',
+    'mp4': '.mp4',
+    'mov': '.mov',
+    'avi': '.avi',
+    'ogg': '.ogv',
+}
+
+# Codec identifiers as they appear in the container headers
+MATROSKA_CODECS = {
+    b'V_VP8': 'vp8',
+    b'V_VP9': 'vp9',
+    b'V_AV1': 'av1',
+    b'V_MPEG4/ISO/AVC': 'h264',
+    b'V_MPEGH/ISO/HEVC': 'hevc',
+}
+MP4_CODECS = {
+    b'avc1': 'h264',
+    b'avc3': 'h264',
+    b'hvc1': 'hevc',
+    b'hev1': 'hevc',
+    b'vp09': 'vp9',
+    b'av01': 'av1',
+}
+
+SNIFF_BYTES = 64 * 1024
+
+logger = logging.getLogger(__name__)
+
+VideoInfo = namedtuple('VideoInfo', ['container', 'codec', 'width', 'height', 'fps', 'frame_count', 'duration'])
+
+
+class VideoDecodeError(Exception):
+    # The upload has no video track, or it cannot be decoded
+    pass
+
+
+def sniff_container(head):
+    if head[:4] == b'\x1a\x45\xdf\xa3':
+        # EBML header; the DocType tells WebM and generic Matroska apart
+        return 'webm' if b'webm' in head[:64] else 'matroska'
+    if head[4:8] == b'ftyp':
+        return 'mov' if head[8:12] == b'qt  ' else 'mp4'
+    if head[:4] == b'RIFF' and head[8:12] == b'AVI ':
+        return 'avi'
+    if head[:4] == b'OggS':
+        return 'ogg'
+    return None
+
+
+def sniff_codec(head, container):
+    if container in ('webm', 'matroska'):
+        codecs = MATROSKA_CODECS
+    elif container in ('mp4', 'mov'):
+        codecs = MP4_CODECS
+    else:
+        return None
+    for marker, codec in codecs.items():
+        if marker in head:
+            return codec
+    return None
+
+
+def save_upload(file_storage, base_path):
+    # Save an uploaded video next to base_path with the extension of its real
+    # container and return the path that was written.
+    stream = file_storage.stream
+    head = stream.read(SNIFF_BYTES)
+    stream.seek(0)
+    container = sniff_container(head)
+    video_path = base_path + CONTAINER_EXTENSIONS.get(container, '.mp4')
+    os.makedirs(os.path.dirname(video_path) or '.', exist_ok=True)
+    file_storage.save(video_path)
+    return video_path
+
+
+def probe_video(video_path):
+    with open(video_path, 'rb') as f:
+        head = f.read(SNIFF_BYTES)
+    container = sniff_container(head)
+    codec = sniff_codec(head, container)
+
+    if av is not None:
+        try:
+            with av.open(video_path) as c:
+                stream = c.streams.video[0]
+                fps = float(stream.average_rate) if stream.average_rate else None
+                duration = float(c.duration / av.time_base) if c.duration else None
+                frame_count = stream.frames or None
+                if duration is None or frame_count is None:
+                    # MediaRecorder WebM has no duration or frame count in its
+                    # header. Walking the packets is cheap since nothing is decoded.
+                    frame_count, last_time = 0, 0.0
+                    for packet in c.demux(stream):
+                        if packet.pts is not None:
+                            frame_count += 1
+                            last_time = max(last_time, float(packet.pts * packet.time_base))
+                    duration = duration or last_time
+                    if fps is None and last_time > 0:
+                        fps = (frame_count - 1) / last_time
+                return VideoInfo(container, codec or stream.codec_context.name,
+                                 stream.width, stream.height, fps, frame_count, duration)
+        except (av.error.FFmpegError, IndexError):
+            pass
+
+    # OpenCV reports nonsense for live-recorded WebM (fps of 1000, negative
+    # frame counts), so only keep values that look plausible.
+    cap = cv2.VideoCapture(video_path)
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)) or None
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)) or None
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    frame_count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+    cap.release()
+    fps = fps if 0 < fps <= 240 else None
+    frame_count = int(frame_count) if frame_count > 0 else None
+    duration = frame_count / fps if fps and frame_count else None
+    return VideoInfo(container, codec, width, height, fps, frame_count, duration)
+
+
+def scaled_size(width, height, max_width):
+    if not max_width or width <= max_width:
+        return width, height
+    # Keep dimensions even, some scalers and encoders require it
+    scaled_height = int(round(height * max_width / width / 2.0)) * 2
+    return max_width, max(scaled_height, 2)
+
+
+def read_frames(video_path, max_width=None, start=0.0, backend=None):
+    # Yield (timestamp_in_seconds, rgb_frame) for every frame of the video,
+    # optionally downscaled to max_width and starting from `start` seconds.
+    # Raises VideoDecodeError if the file has no video that can be decoded.
+    if backend is None:
+        backend = 'pyav' if av is not None else 'opencv'
+    if backend == 'pyav':
+        if av is None:
+            raise ValueError("The pyav backend needs PyAV installed")
+        try:
+            container = av.open(video_path)
+        except av.error.FFmpegError:
+            container = None
+        if container is not None:
+            if not container.streams.video:
+                container.close()
+                raise VideoDecodeError("Upload has no video track")
+            return _read_frames_pyav(container, max_width, start)
+    return _read_frames_opencv(video_path, max_width, start)
+
+
+def _has_timestamps(container, stream):
+    for packet in container.demux(stream):
+        if packet.size:
+            return packet.pts is not None
+    return False
+
+
+def _read_frames_pyav(container, max_width, start):
+    with container:
+        stream = container.streams.video[0]
+        # Frame and slice threading in the decoder
+        stream.thread_type = 'AUTO'
+        fps = float(stream.average_rate) if stream.average_rate else 30.0
+        seeked = False
+        if start > 0 and stream.time_base:
+            # Jump to the keyframe before `start` and decode forward from
+            # there. Without timestamps there is no telling where a seek
+            # landed, so such streams are decoded from the beginning.
+            seeked = _has_timestamps(container, stream)
+            try:
+                container.seek(int(start / stream.time_base) if seeked else 0, stream=stream, backward=True)
+            except av.error.FFmpegError as e:
+                raise VideoDecodeError(f"Video could not be decoded: {e}")
+
+        size = None
+        timestamp = None
+        frames = container.decode(stream)
+        index = 0
+        while True:
+            try:
+                frame = next(frames)
+            except StopIteration:
+                break
+            except av.error.FFmpegError as e:
+                if size is None:
+                    raise VideoDecodeError(f"Video could not be decoded: {e}")
+                # A truncated upload, keep what was decoded
+                logger.warning("Stopped decoding %s after %d frames: %s", container.name, index, e)
+                break
+            if frame.time is not None:
+                timestamp = frame.time
+            elif seeked and timestamp is not None:
+                timestamp += 1.0 / fps
+            else:
+                timestamp = index / fps
+            index += 1
+            if timestamp < start:
+                continue
+            if size is None:
+                size = scaled_size(frame.width, frame.height, max_width)
+            yield timestamp, frame.to_ndarray(format='rgb24', width=size[0], height=size[1])
+
+
+def _read_frames_opencv(video_path, max_width, start):
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        cap.release()
+        raise VideoDecodeError("Video could not be decoded")
+    try:
+        if start > 0:
+            cap.set(cv2.CAP_PROP_POS_MSEC, start * 1000.0)
+        size = None
+        while cap.isOpened():
+            ret, frame = cap.read()
+            if not ret:
+                break
+            timestamp = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+            if timestamp < start:
+                continue  # Seeking is not supported by every OpenCV backend
+            if size is None:
+                size = scaled_size(frame.shape[1], frame.shape[0], max_width)
+            if size != (frame.shape[1], frame.shape[0]):
+                frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+            yield timestamp, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    finally:
+        cap.release()